@@ -1,172 +1,35 @@
 #!/usr/bin/env python
 
+from antglob import ant_rules
+
 import ansi
+import configcache
 import difftools
+import executor
+import fingerprint
 import fs
+import githash
+import gittools
+import hashcache
+import journal
+import localstate
+import manifest
 import rpmtools
 
 import git
 
 import collections
+import itertools
 import os
 import pwd
 import re
 import socket
+import stat
 import subprocess
 import sys
 import tempfile
 
 
-## Taken from http://code.google.com/p/waf/source/browse/waflib/Node.py
-def ant_glob(*k, **kw):
-  """
-  This method is used for finding files across folders. It behaves like ant patterns:
-
-
-  * ``**/*`` find all files recursively
-  * ``**/*.class`` find all files ending by .class
-  * ``..`` find files having two dot characters
-
-
-  For example::
-
-
-          def configure(cfg):
-                  cfg.path.ant_glob('**/*.cpp') # find all .cpp files
-                  cfg.root.ant_glob('etc/*.txt') # using the filesystem root can be slow
-                  cfg.path.ant_glob('*.cpp', excl=['*.c'], src=True, dir=False)
-
-
-  For more information see http://ant.apache.org/manual/dirtasks.html
-
-
-  The nodes that correspond to files and folders that do not exist will be removed. To prevent this
-  behaviour, pass 'remove=False'
-
-
-  :param incl: ant patterns or list of patterns to include
-  :type incl: string or list of strings
-  :param excl: ant patterns or list of patterns to exclude
-  :type excl: string or list of strings
-  :param dir: return folders too (False by default)
-  :type dir: bool
-  :param src: return files (True by default)
-  :type src: bool
-  :param remove: remove files/folders that do not exist (True by default)
-  :type remove: bool
-  :param maxdepth: maximum depth of recursion
-  :type maxdepth: int
-  :param ignorecase: ignore case while matching (False by default)
-  :type ignorecase: bool
-  """
-
-  src = kw.get('src', True)
-  dir = kw.get('dir', False)
-  maxdepth = kw.get('maxdepth', 25)
-
-  excl = kw.get('excl', ['.git', '.gitignore'])
-  incl = k and k[0] or kw.get('incl', '**')
-  reflags = kw.get('ignorecase', 0) and re.I
-  start_dir = kw.get('start_dir')
-
-  listdir = os.listdir
-
-  def ant_iter(current_dir, accept=None, maxdepth=25, pats=[], dir=False, src=True, remove=True):
-    """
-    Semi-private and recursive method used by ant_glob.
-
-
-    :param accept: function used for accepting/rejecting a node, returns the patterns that can be still accepted in recursion
-    :type accept: function
-    :param maxdepth: maximum depth in the filesystem (25)
-    :type maxdepth: int
-    :param pats: list of patterns to accept and list of patterns to exclude
-    :type pats: tuple
-    :param dir: return folders too (False by default)
-    :type dir: bool
-    :param src: return files (True by default)
-    :type src: bool
-    """
-    dircont = listdir(current_dir)
-    dircont.sort()
-
-    for name in dircont:
-      npats = accept(name, pats)
-      if npats and npats[0]:
-        accepted = [] in npats[0]
-        abspath = os.path.join(current_dir, name)
-        isdir = os.path.isdir(abspath)
-        if accepted:
-          if isdir:
-            if dir:
-              yield abspath
-          else:
-            if src:
-              yield abspath
-        if isdir:
-          if maxdepth:
-            for k in ant_iter(abspath, accept=accept, maxdepth=maxdepth - 1, pats=npats, dir=dir, src=src):
-              yield k
-    raise StopIteration
-
-  def to_list(sth):
-    if isinstance(sth, str):
-      return sth.split()
-    else:
-      return sth
-
-  def to_pat(s):
-    lst = to_list(s)
-    ret = []
-    for x in lst:
-      x = x.replace('\\', '/').replace('//', '/')
-      if x.endswith('/'):
-        x += '**'
-      lst2 = x.split('/')
-      accu = []
-      for k in lst2:
-        if k == '**':
-          accu.append(k)
-        else:
-          k = k.replace('.', '[.]').replace('*','.*').replace('?', '.').replace('+', '\\+')
-          k = '^%s$' % k
-          try:
-            accu.append(re.compile(k, flags=reflags))
-          except Exception as e:
-            raise Exception('Invalid pattern: %s' % k, e)
-      ret.append(accu)
-    return ret
-
-
-  def filtre(name, nn):
-    ret = []
-    for lst in nn:
-      if not lst:
-        pass
-      elif lst[0] == '**':
-        ret.append(lst)
-        if len(lst) > 1:
-          if lst[1].match(name):
-            ret.append(lst[2:])
-        else:
-            ret.append([])
-      elif lst[0].match(name):
-        ret.append(lst[1:])
-    return ret
-
-  def accept(name, pats):
-    nacc = filtre(name, pats[0])
-    nrej = filtre(name, pats[1])
-    if [] in nrej:
-      nacc = []
-    return [nacc, nrej]
-
-  ret = [x for x in ant_iter(start_dir, accept=accept, pats=[to_pat(incl), to_pat(excl)], maxdepth=maxdepth, dir=dir, src=src)]
-  #if kw.get('flat', False):
-  #  return ' '.join([x.path_from(self) for x in ret])
-  return ret
-
-
 def exists(path):
   'Like os.path.exists(), but also returns true for dangling symlink'
   return os.path.islink(path) or os.path.exists(path)
@@ -181,7 +44,7 @@ def parse_config(line, config):
 
 
 class ConcatCrontabs:
-  def __init__(self, files):
+  def __init__(self, files, open=open):
     fd, self.tmpfilename = tempfile.mkstemp()
     with os.fdopen(fd, 'w') as tmpfile:
       print >> tmpfile, '### THIS FILE WAS AUTOGENERATED BY GITMAN. DO NOT EDIT! ###'
@@ -210,24 +73,28 @@ class ConcatCrontabs:
 
 
 class GitManCallbacks:
-  def __init__(self, path, config):
+  def __init__(self, path, config, exists=os.path.exists):
     if 'pre-script' in config:
       self.pre_script = os.path.join(path, config['pre-script'])
-      if not os.path.exists(self.pre_script):
+      if not exists(self.pre_script):
         raise RuntimeError('Missing pre-script: %s' % self.pre_script)
 
     if 'post-script' in config:
       self.post_script = os.path.join(path, config['post-script'])
-      if not os.path.exists(self.post_script):
+      if not exists(self.post_script):
         raise RuntimeError('Missing post-script: %s' % self.post_script)
 
     if 'deploy-script' in config:
       self.deploy_script = os.path.join(path, config['deploy-script'])
-      if not os.path.exists(self.deploy_script):
+      if not exists(self.deploy_script):
         raise RuntimeError('Missing deploy-script: %s' % self.deploy_script)
 
     self.callbacks = list()
 
+  def uses_scripts(self):
+    return any(hasattr(self, script) for script in
+               ('pre_script', 'post_script', 'deploy_script'))
+
   def run_pre_script(self):
     if hasattr(self, 'pre_script'):
       ansi.writeout('Executing pre-script: %s' % self.pre_script)
@@ -274,15 +141,21 @@ class GitManCallbacks:
 
 
 class GitMan:
-  def __init__(self, path, origin=None, branch='master', info=None, assume_host=None, deploy_file='.git/gitman_deploy'):
+  def __init__(self, path, origin=None, branch='master', info=None, assume_host=None, deploy_file='.git/gitman_deploy', plan_from_diff=True, fingerprint_algorithm=None):
     self.path = path
     self.deploy_file = deploy_file + '.' + branch.replace('/', '^')
-    self.rpmdb = rpmtools.RPM_DB()
+    self.__versions = dict()
+    self.__globs = collections.defaultdict(dict)
+    # --info only plans file sets, so it never needs the rpm database
+    self.rpmdb = rpmtools.RPM_DB() if info is None else None
 
     if info:
-      self.host = info
+      self.host = info[0]
     elif assume_host:
       self.host = assume_host
+    elif info is not None:
+      # --info for every host, the local name only seeds the config
+      self.host = socket.gethostname()
     else:
       self.host = socket.gethostbyaddr(socket.gethostname())[0]
 
@@ -298,57 +171,304 @@ class GitMan:
     else:
       self.repo = git.Repo.clone_from(origin, path)
 
+    self.hash_cache = hashcache.HashCache(
+      os.path.join(self.repo.git_dir, 'gitman_hashcache'))
+    self.hasher = githash.BlobHasher(
+      self.repo.working_dir, self.hash_cache,
+      use_git=self.uses_content_filters())
+    self.config_cache = configcache.ConfigCache(
+      os.path.join(self.repo.git_dir, 'gitman_configcache'))
+
     if info is None:
       version = self.deployed_version()
       self.check_is_clean()
     else:
       version = None
 
-    if version:
-      self.switch_to(version)
-      original_config = self.load_config()
-      self.original_files, self.original_crontabs, self.orig_rpms = self.load_files(original_config)
-    else:
-      self.original_files = []
-      self.original_crontabs = {}
-      self.orig_rpms = {}
+    # Both revisions are read straight from git objects; the working tree
+    # is only brought up to date when deploying.
     if info is None:
-      self.switch_to_head_and_update(branch)
-    new_config = self.load_config()
+      self.target = self.update_head(branch)
+      self.tree = gittools.GitTree(self.repo, self.target)
+    else:
+      self.target = None
+      self.tree = gittools.IndexTree(self.repo)
+    new_config = self.load_config(self.tree)
     self.config = new_config
+    if info is None:
+      self.journal = journal.DeployJournal(
+        os.path.join(self.repo.git_dir, 'gitman_journal.' + branch.replace('/', '^')),
+        version, self.target)
+      self.manifest = manifest.Manifest(
+        os.path.join(self.repo.git_dir, 'gitman_manifest'),
+        fingerprint.Fingerprint(fingerprint_algorithm)
+        if fingerprint_algorithm or fingerprint.ALGORITHMS else None)
+    else:
+      self.journal = None
+      self.manifest = None
+
+    self.original_files = []
+    self.original_crontabs = {}
+    self.orig_rpms = {}
+    if info is not None:
+      # hosts are compiled on demand by host_info()
+      self.info_hosts = list(info) or self.list_hosts()
+      self.new_files, self.new_crontabs, self.new_rpms = {}, {}, {}
+    else:
+      plan = dict()
+      self.new_files, self.new_crontabs, self.new_rpms = self.load_files(new_config, self.tree, plan)
+      if version and not (plan_from_diff and self.plan_original(version, plan)):
+        self.load_original(version)
+      self.rpmdb = rpmtools.RPM_DB(rpm_ignore_mtime=(self.config.get('rpm_ignore_mtime', 'False').lower()=='true'))
 
-    if info:
-      self.config['host'] = info
-      self.config['host_file'] = info
+    self.callbacks = GitManCallbacks(self.path, self.config, self.tree.exists)
+    self.modified = list()
+    self.inspected = False
+    self.resumed_files = set()
+    self.acl_only_files = set()
+    self.stats = fs.StatSnapshot()
+
+  def uses_content_filters(self, tree=None):
+    '''True if git may rewrite content on hash-object or checkout (attributes
+       or autocrlf).  .gitattributes files are looked for in the index, or in
+       tree, a GitTree, if given.'''
+    if os.path.exists(os.path.join(self.repo.git_dir, 'info', 'attributes')):
+      return True
+    if tree is not None:
+      if any(os.path.basename(path) == '.gitattributes' for path in tree.entries):
+        return True
+    elif self.repo.git.ls_files('--', '.gitattributes', '*/.gitattributes'):
+      return True
+    return bool(self.repo.git.config('--get-regexp', r'^(core\.autocrlf|filter\.)',
+                                     with_exceptions=False))
+
+  def hash_file(self, path, cache=True):
+    "Symlinks hash to their target and empty files to 0, see BlobHasher"
+    return self.hasher.hash(path, cache)
+
+  @staticmethod
+  def glob_rules(rules, tree, memo=None):
+    '''Expand include and exclude rules into lists of [file, args] and
+       [file, root].  All the rules for a root are evaluated in a single
+       walk, and each file gets the attributes of the last include that
+       matches it.  Files an exclude matches in their own root are left
+       out; excludes only need to be listed for other roots.  Walks are
+       looked up in and added to memo, a dict kept per tree, when given.'''
+    by_root = collections.OrderedDict()
+    for n, rule in enumerate(rules):
+      by_root.setdefault(rule[1], []).append((n, rule))
+    dropped = [] if len(by_root) > 1 else None
 
-    self.new_files, self.new_crontabs, self.new_rpms = self.load_files(new_config)
-    self.rpmdb = rpmtools.RPM_DB(rpm_ignore_mtime=(self.config.get('rpm_ignore_mtime', 'False').lower()=='true'))
+    include_files = []
+    exclude_files = []
+    for root, root_rules in by_root.iteritems():
+      if not tree.isdir(root):
+        continue
+      includes = [(n, rule) for n, rule in root_rules if rule[0] == 'include']
+      excludes = [rule[2] for n, rule in root_rules if rule[0] == 'exclude']
+      patterns = [rule[2] for n, rule in includes]
+      key = (root, tuple(patterns), tuple(excludes), dropped is not None)
+      if memo is not None and key in memo:
+        files, root_dropped = memo[key]
+      else:
+        if dropped:
+          del dropped[:]
+        files = ant_rules(root, patterns, excludes, tree=tree, dropped=dropped)
+        root_dropped = list(dropped or ())
+        if memo is not None:
+          memo[key] = files, root_dropped
+      for file, file_isdir, i in files:
+        n, (kind, root, pattern, acl, diracl, dir_attr) = includes[i]
+        if file_isdir:
+          fileacl = diracl
+        else:
+          fileacl = acl
+        include_files.append((n, [file, dict(acl=fileacl, root=root, dirattr=dir_attr,
+                                             isdir=file_isdir, realfile=file)]))
+      exclude_files.extend([file, root] for file in root_dropped)
+    # later rules win when several roots map to the same deployed path
+    include_files.sort(key=lambda item: item[0])
+    return [file for n, file in include_files], exclude_files
+
+  @staticmethod
+  def file_map(include_files, exclude_files, hashes):
+    'Key globbed files by their deployed path; later includes win'
+    files = {}
+    for file, args in include_files:
+      if not args['isdir']:
+        args['hash'] = hashes[file]
+      file = file[len(args['root']):]
+      files[file] = args
 
-    self.callbacks = GitManCallbacks(self.path, self.config)
-    self.modified = list()
+    for file, root in exclude_files:
+      file = file[len(root):]
+      files.pop(file, None)
+    return files
 
-  def hash_file(self, path):
-    "git.hash_object() doesn't support empty files, so we need to check this"
-    if os.path.islink(path):
-      return os.readlink(path)
-    if os.path.exists(path) and os.path.getsize(path) == 0:
-      return 0
-    return self.repo.git.hash_object(path, with_keep_cwd=True) 
+  def plan_original(self, version, plan):
+    '''Derive the deployed file map from the newest one and a git diff-tree
+       against version, without checking version out.  Returns False when
+       the host files, their imports or the crontabs changed, or when files
+       were added or deleted under one of several roots, which may map them
+       onto the same deployed path; the deployed revision then has to be
+       loaded in full.'''
+    changes = gittools.diff_tree(self.repo, version, self.target)
+    if any(change.path in plan['sources'] for change in changes):
+      return False
+
+    prefixes = set()
+    for root in plan['roots']:
+      root = os.path.relpath(root, self.path)
+      prefixes.add('' if root == '.' else root + '/')
+    def root_of(path):
+      for prefix in prefixes:
+        if path.startswith(prefix):
+          return prefix
+      return None
+
+    if len(prefixes) > 1 and any(change.status in ('A', 'D') and
+                                 root_of(change.path) is not None
+                                 for change in changes):
+      return False
+
+    session = gittools.cat_file_session(self.repo)
+    def old_hash(change):
+      return gittools.object_hash(change.old_mode, change.old_sha,
+                                  lambda: session.read(change.old_sha))
+
+    files = dict((file, dict(args)) for file, args in self.new_files.iteritems())
+    by_realfile = dict((args['realfile'], file) for file, args in files.iteritems())
+    new_dirs = set()
+    deleted = []
+    for change in changes:
+      prefix = root_of(change.path)
+      if prefix is None:
+        continue
+      file = by_realfile.get(os.path.join(self.path, change.path))
+      if change.status == 'A':
+        if file:
+          files.pop(file)
+        parent = os.path.dirname(change.path)
+        while parent and len(parent) >= len(prefix):
+          new_dirs.add(parent)
+          parent = os.path.dirname(parent)
+      elif change.status == 'D':
+        deleted.append(change)
+      elif file:
+        files[file].update(hash=old_hash(change), blob=change.old_sha,
+                           gitmode=change.old_mode)
+
+    # directories only populated by added files did not exist before
+    if new_dirs:
+      for dir in new_dirs - gittools.existing_paths(self.repo, version, new_dirs):
+        files.pop(by_realfile.get(os.path.join(self.path, dir)), None)
+
+    # evaluate the unchanged rules against a tree of just the deleted files
+    if deleted:
+      tree = gittools.PathTree(os.path.join(self.path, change.path)
+                               for change in deleted)
+      hashes = dict((os.path.join(self.path, change.path), old_hash(change))
+                    for change in deleted)
+      include_files, exclude_files = self.glob_rules(plan['rules'], tree)
+      for file, args in self.file_map(include_files, exclude_files, hashes).iteritems():
+        if not args['isdir'] or file not in files:
+          files[file] = args
+
+    self.original_files = files
+    self.original_crontabs = self.new_crontabs
+    self.orig_rpms = dict(self.new_rpms)
+    return True
+
+  def close(self):
+    'Save caches and stop any helper git processes'
+    if self.journal is not None:
+      self.journal.close()
+    if self.manifest is not None:
+      self.manifest.save()
+    self.hasher.close()
+    self.hash_cache.save()
+    gittools.close_sessions()
+
+  def load_original(self, version):
+    tree = gittools.GitTree(self.repo, version)
+    original_config = self.load_config(tree)
+    self.original_files, self.original_crontabs, self.orig_rpms = self.load_files(original_config, tree)
+
+  def load_files(self, config, tree, plan=None):
+    '''Parse the host file from tree (a GitTree or IndexTree) and return
+       (files, crontabs, rpms).  If plan is given it is filled with the
+       include/exclude rules, their roots and the repo paths the result
+       depends on, see plan_original().'''
+    compiled = self.compile_host(config, tree)
+    config['host_file'] = compiled['host_file']
+
+    if plan is not None:
+      plan['rules'] = compiled['rules']
+      plan['roots'] = set(rule[1] for rule in compiled['rules'])
+      plan['sources'] = compiled['sources']
+
+    files = {}
+    for file, root, acl, dirattr, isdir, hash, blob, gitmode in compiled['files']:
+      args = dict(acl=acl, root=root, dirattr=dirattr, isdir=isdir,
+                  realfile=root + file)
+      if not isdir:
+        args['hash'] = hash
+        args['blob'] = blob
+        args['gitmode'] = gitmode
+      files[file] = args
+
+    crontabs = collections.defaultdict(dict)
+    for user, crontab_files in compiled['crontabs'].iteritems():
+      crontab = ConcatCrontabs(crontab_files, tree.open)
+      crontabs[user] = dict(user=user, files=crontab_files, crontab=crontab,
+                            hash=self.hash_file(crontab.name, cache=False))
+
+    rpms = {}
+    for url in compiled['rpms']:
+      pkg = rpmtools.Package(url, rpmdb=self.rpmdb)
+      rpms[pkg.name] = pkg
+
+    return files, crontabs, rpms
+
+  def compile_host(self, config, tree):
+    '''Compile the host file into a dict of the resolved file map, crontab
+       files, rpm urls, rules and source paths.  Results for a GitTree are
+       kept in the config cache for as long as the object ids of the config,
+       the host file, its imports, the crontabs and the roots are unchanged.'''
+    object_id = getattr(tree, 'object_id', None)
+    key = (self.path, config['host'], config['short_host'], config['host_file'], has_xacl)
+    if object_id:
+      resolve = lambda path: object_id(os.path.join(self.path, path))
+      compiled = self.config_cache.get(key, resolve)
+      if compiled is not None:
+        return compiled
 
-  def load_files(self, config):
     host_file = os.path.join(self.path, config['host_dir'], config['host_file'])
-    if not os.path.exists(host_file):
+    sources = set(['config', os.path.relpath(host_file, self.path)])
+    if not tree.exists(host_file):
       if 'default_host_file' in config:
         host_file = os.path.join(self.path, config['host_dir'], config['default_host_file'])
         config['host_file'] = config['default_host_file']
     comment = re.compile('^\s*#')
 
-    include_files = []
-    exclude_files = []
-    crontabs = collections.defaultdict(dict)
-    rpms = {}
-
-    def parse_file(file):
+    # Every file is parsed in the same fresh context (root, defattr and
+    # dirattr are reset), so what a file and its imports contribute only
+    # depends on its path: each one is parsed once and its directives are
+    # replayed wherever it is imported again.
+    parsed = dict()
+
+    def parse_file(file, importing=()):
+      if file in importing:
+        cycle = importing[importing.index(file):] + (file,)
+        raise RuntimeError('Import cycle: %s' % ' -> '.join(
+          os.path.relpath(f, self.path) for f in cycle))
+      if file not in parsed:
+        parsed[file] = read_file(file, importing + (file,))
+      return parsed[file]
+
+    def read_file(file, importing):
+      directives = [('source', os.path.relpath(file, self.path))]
+      emit = directives.append
       root = os.path.join(self.path, config['root'])
       default_attr = None
       dir_attr = None
@@ -398,7 +518,7 @@ class GitMan:
         return (ACL.from_components(user, group, mode, xattr),
                 ACL.from_components(user, group, dirmode, dirxattr))
 
-      with open(file) as f:
+      with tree.open(file) as f:
         for line in f:
           line = line.strip()
           if not line or comment.match(line):
@@ -408,7 +528,8 @@ class GitMan:
             root = parse_config(rest.strip(), config)
             root = os.path.join(self.path, root)
           elif cmd == 'import':
-            parse_file(os.path.join(self.path, config['host_dir'], rest.strip()))
+            directives.extend(parse_file(
+              os.path.join(self.path, config['host_dir'], rest.strip()), importing))
           elif cmd == 'defattr':
             rest = rest.split()
             if len(rest) == 1 and rest[0] == 'default':
@@ -420,13 +541,12 @@ class GitMan:
             user, file = rest.strip().split(' ')
             #TODO: verify is valid crontab file
             crontab_path = os.path.join(root, file)
-            if not os.path.exists(crontab_path):
+            if not tree.exists(crontab_path):
               raise RuntimeError('Crontab file %s does not exist' % crontab_path)
-            crontabs[user].setdefault('files', list()).append(crontab_path)
-            crontabs[user]['user'] = user
+            emit(('crontab', (user, crontab_path)))
+            emit(('source', os.path.relpath(crontab_path, self.path)))
           elif cmd == 'rpm':
-            pkg = rpmtools.Package(rest.strip(), rpmdb=self.rpmdb)
-            rpms[pkg.name] = pkg
+            emit(('rpm', rest.strip()))
           elif cmd == 'include':
             a = rest.split(' ')
             pattern = a[0]
@@ -438,43 +558,51 @@ class GitMan:
             pattern = pattern.strip()
             if pattern[0] == '/':
               pattern = pattern[1:]
-            if os.path.isdir(root):
-              files = ant_glob(start_dir=root, incl=pattern.strip(), dir=True)
-              for file in files:
-                if os.path.isdir(file):
-                  fileacl = diracl
-                else:
-                  fileacl = acl
-                include_files.append([file, dict(acl=fileacl, root=root, dirattr=dir_attr)])
+            emit(('rule', ('include', root, pattern.strip(), acl, diracl, dir_attr)))
           elif cmd == 'exclude':
             pattern = rest.strip()
             if pattern[0] == '/':
               pattern = pattern[1:]
-            exclude_files.extend(ant_glob(start_dir=root, incl=pattern, dir=True))
+            emit(('rule', ('exclude', root, pattern, None, None, None)))
           else:
             raise RuntimeError('Unknown line in config file: %s' % line)
-    parse_file(host_file)
-    files = {}
-    for file, args in include_files:
-      f = os.path.join(self.path, file)
-      args['isdir'] = os.path.isdir(file)
-      args['realfile'] = file
-      if not args['isdir']:
-        args['hash'] = self.hash_file(file)
-      file = file[len(args['root']):]
-      files[file] = args
-
-    for file in exclude_files:
-      file = file[len(args['root']):]
-      files.pop(file, None)
-
-    for usercrontabs in crontabs.values():
-      crontab = ConcatCrontabs(usercrontabs['files'])
-      hash = self.hash_file(crontab.name)
-      usercrontabs['hash'] = hash
-      usercrontabs['crontab'] = crontab
-
-    return files, crontabs, rpms
+      return directives
+
+    rules = []
+    crontabs = collections.OrderedDict()
+    rpms = []
+    for kind, value in parse_file(host_file):
+      if kind == 'rule':
+        rules.append(value)
+      elif kind == 'crontab':
+        crontabs.setdefault(value[0], list()).append(value[1])
+      elif kind == 'rpm':
+        rpms.append(value)
+      else:
+        sources.add(value)
+    include_files, exclude_files = self.glob_rules(rules, tree, self.__globs[tree])
+    hashes = dict((file, tree.hash(file)) for file, args in include_files
+                  if not args['isdir'])
+    files = self.file_map(include_files, exclude_files, hashes)
+
+    def object_of(args):
+      entry = None if args['isdir'] else tree.entries.get(args['realfile'])
+      return (entry.sha, entry.mode) if entry else (None, None)
+
+    compiled = dict(
+      host_file=config['host_file'],
+      files=[(file, args['root'], args['acl'], args['dirattr'], args['isdir'],
+              args.get('hash')) + object_of(args) for file, args in files.iteritems()],
+      crontabs=crontabs,
+      rpms=rpms,
+      rules=rules,
+      sources=sources)
+    if object_id:
+      deps = set(sources)
+      deps.update(os.path.relpath(rule[1], self.path) for rule in rules)
+      self.config_cache.put(key, [(path, resolve(path)) for path in sorted(deps)],
+                            compiled)
+    return compiled
 
   def crontab_hash(self, user):
     try:
@@ -487,7 +615,7 @@ class GitMan:
         raise RuntimeError('Failed to run: %s' % cmd)
       if status == 1:
         return 0
-      return self.hash_file(tmp)
+      return self.hash_file(tmp, cache=False)
     finally:
       os.unlink(tmp)
 
@@ -542,7 +670,7 @@ class GitMan:
   def modified_rpms(self):
     return [self.new_rpms[rpm] for rpm in set(self.new_rpms) & set(self.orig_rpms)]
 
-  def show_deployment(self, show_diffs, show_holdup_diffs):
+  def show_deployment(self, show_diffs, show_holdup_diffs, threads=16):
     verbose_info = []
     holdups = []
     failures = []
@@ -558,13 +686,39 @@ class GitMan:
       failures.append(str)
       verbose_info.append(str)
 
+    deleted_files = self.deleted_files()
+    added_files = self.added_files()
+    common_files = self.common_files()
+
+    # gather the local state of every file concurrently, the checks below
+    # then run in order against it
+    local = localstate.LocalState(self.hasher, ACL.from_file, self.stats, threads,
+                                  manifest=self.manifest)
+    def state(args):
+      return None if args['isdir'] else args['hash'], args['acl']
+    local.gather(
+      [(file, not orig_args['isdir'], False) for file, sys_file, orig_args in deleted_files] +
+      [(file, not new_args['isdir'], True, [state(new_args)])
+       for file, sys_file, new_args in added_files] +
+      [(file, not orig_args['isdir'], True, [state(orig_args), state(new_args)])
+       for file, sys_file, orig_args, new_args in common_files])
+
+    if self.journal:
+      verbose('RESUMING interrupted deployment, %d steps already done' %
+              len(self.journal))
+    self.resumed_files = set()
+
     #Find files that will be deleted, only if they are unchanged
-    for file, sys_file, orig_args in self.deleted_files():
-      if not exists(file):
+    for file, sys_file, orig_args in deleted_files:
+      if not local.exists(file):
+        if ('delete', file) in self.journal:
+          verbose('DELETED: %s' % file)
+          self.callbacks.delete_file(file)
+          continue
         verbose('DELETED and already removed: %s' % file)
         self.callbacks.already_deleted_file(file)
       else:
-        if not orig_args['isdir'] and self.hash_file(file) != orig_args['hash']:
+        if not orig_args['isdir'] and local.hash(file) != orig_args['hash']:
           holdup('DELETED but has local differences: %s' % file)
           if show_diffs or show_holdup_diffs:
             verbose(difftools.get_diff_deployed_to_fs(
@@ -574,10 +728,13 @@ class GitMan:
         self.callbacks.delete_file(file)
 
     #Find files that will be added, assuming they don't already exist
-    for file, sys_file, new_args in self.added_files():
-      if exists(file):
-        if new_args['isdir'] or self.hash_file(file) == new_args['hash']:
-          file_acl = ACL.from_file(file)
+    for file, sys_file, new_args in added_files:
+      if self.resumed(local, file, new_args):
+        verbose('ADDED: %s' % file)
+        self.callbacks.add_file(file)
+      elif local.exists(file):
+        if new_args['isdir'] or local.hash(file) == new_args['hash']:
+          file_acl = local.acl(file)
           git_acl = new_args['acl']
           if file_acl != git_acl:
             holdup('ADDED and exists locally: %s\n  PERMISSIONS INCORRECT: %s (locally) -> %s' %
@@ -599,11 +756,16 @@ class GitMan:
         self.callbacks.add_file(file)
 
     #Find files that will be update
-    for file, sys_file, orig_args, new_args in self.common_files():
+    for file, sys_file, orig_args, new_args in common_files:
+      if self.resumed(local, file, new_args):
+        verbose('MODIFIED: %s' % file)
+        self.modified.append((file, sys_file, orig_args, new_args))
+        self.callbacks.modify_file(file)
+        continue
       modified = False
       new_acl = new_args['acl']
       orig_acl = orig_args['acl']
-      file_acl = ACL.from_file(file)
+      file_acl = local.acl(file)
       if new_acl != orig_acl:
         holdup('PERMISSIONS changed in repo: %s from %s -> %s' %
                (file, orig_acl, new_acl))
@@ -615,11 +777,11 @@ class GitMan:
           holdup('PERMISSIONS were locally modified: %s from %s -> %s' %
                  (file, orig_acl, file_acl))
           modified = True
-      if not exists(file):
+      if not local.exists(file):
         holdup('LOCAL file missing: %s' % file)
         modified = True
-      elif not orig_args['isdir'] and self.hash_file(file) != orig_args['hash']:
-        if not orig_args['isdir'] and self.hash_file(file) != new_args['hash']:
+      elif not orig_args['isdir'] and local.hash(file) != orig_args['hash']:
+        if not orig_args['isdir'] and local.hash(file) != new_args['hash']:
           holdup('LOCAL file has changes: %s' % file)
           modified = True
           if show_diffs or show_holdup_diffs:
@@ -662,7 +824,9 @@ class GitMan:
       user = crontab_new['user']
       crontab_orig = self.original_crontabs[user]
       hash = self.crontab_hash(user)
-      if hash != crontab_orig['hash']:
+      if ('crontab', user) in self.journal and hash == crontab_new['hash']:
+        verbose('MODIFIED crontab: %s' % user)
+      elif hash != crontab_orig['hash']:
         holdup('MODIFIED crontab but has local differences: %s' % user)
       elif crontab_new['hash'] == crontab_orig['hash']:
         continue
@@ -731,74 +895,209 @@ class GitMan:
 
     self.rpmdb.run(test=True, holdup=holdup)
 
+    self.inspected = True
     return holdups, verbose_info, failures
 
-  def deploy(self, force, backup, reinstall=True):
+  def deploy(self, force, backup, reinstall=True, from_objects=False, threads=1):
+    '''Apply the changes show_deployment found.  With from_objects files are
+       written straight from git objects and the working tree is not checked
+       out, unless a pre-, post- or deploy-script needs it or git would
+       filter content on checkout (smudge, eol, LFS).  Files are
+       written by up to threads threads, one directory level at a time.
+       Finished steps go to self.journal, so that a deploy that is cut short
+       can be rerun without redoing them.'''
+    from_objects = (from_objects and self.target and not self.hasher.use_git and
+                    not self.callbacks.uses_scripts() and
+                    not self.uses_content_filters(self.tree))
+    if self.target and not from_objects:
+      self.switch_to(self.target)
+    self.journal.begin()
     self.callbacks.run_pre_script()
-
-    #Delete files
-    for file, sys_file, orig_args in reversed(self.deleted_files()):
-      if exists(file):
-        if backup:
-          os.rename(file, '%s.gitman' % file)
-        elif orig_args['isdir']:
-          try:
-            os.rmdir(file)
-          except:
-            ansi.writeout('${BRIGHT_RED}ERROR: Failed to remove directory: %s${RESET}' % file)
-        else:
-          os.unlink(file)
-
-    #Add files
-    for file, sys_file, new_args in self.added_files():
-      dir = os.path.dirname(file)
-      if not os.path.isdir(dir):
-        os.makedirs(dir)
-        if new_args['dirattr']:
-          new_args['dirattr'].applyto(dir)
-      if new_args['isdir']:
-        if not os.path.exists(file):
-          os.mkdir(file)
-      else:
-        fs.copy(sys_file, file, backup)
-      if not os.path.islink(file):
-        new_args['acl'].applyto(file)
-
-    #Update files
-    for file, sys_file, orig_args, new_args in self.common_files():
-      dir = os.path.dirname(file)
-      if not os.path.isdir(dir):
-        os.makedirs(dir)
-        if new_args['dirattr']:
-          new_args['dirattr'].applyto(dir)
-      if new_args['isdir']:
-        if not os.path.exists(file):
-          os.mkdir(file)
-      else:
-        fs.copy(sys_file, file, backup)
-      if not os.path.islink(file):
-        new_args['acl'].applyto(file)
+    # the pre-script may have touched anything
+    self.stats = fs.StatSnapshot()
+    self.dirs = fs.DirCache(self.stats)
+
+    with executor.LevelExecutor(threads) as levels:
+      #Delete files, children before their parents
+      errors = levels.run(
+        self.deleted_files(),
+        lambda entry: self.remove_file(entry[0], entry[2], backup),
+        bottom_up=True)
+      for error in reversed(errors):
+        if error:
+          ansi.writeout('${BRIGHT_RED}ERROR: %s${RESET}' % error)
+
+      #Add and update files, parents before their children
+      installs = [(file, sys_file, new_args)
+                  for file, sys_file, new_args in self.added_files()
+                  if not (('acl', file) in self.journal and
+                          file in self.resumed_files and
+                          self.up_to_date(file, new_args))]
+      installs.extend((file, sys_file, new_args)
+                      for file, sys_file, orig_args, new_args in self.files_to_update())
+      levels.run(
+        installs,
+        lambda entry: self.install_file(entry[0], entry[1], entry[2],
+                                        backup, from_objects))
 
     for crontab in self.deleted_crontabs():
+      if ('crontab-delete', crontab['user']) in self.journal:
+        continue
       cmd = 'crontab -r -u %s' % crontab['user']
       if 0 != os.system(cmd):
         raise RuntimeError('Failed to run cmd: %s' % cmd)
+      self.journal.record('crontab-delete', crontab['user'])
 
     crontabs = self.added_crontabs()
     crontabs.extend(self.modified_crontabs())
 
     for crontab in crontabs:
+      if (('crontab', crontab['user']) in self.journal and
+          self.crontab_hash(crontab['user']) == crontab['hash']):
+        continue
       cmd = 'crontab -u %s %s' % (crontab['user'], crontab['crontab'].name)
       if 0 != os.system(cmd):
         raise RuntimeError('Failed to run cmd: %s' % cmd)
+      self.journal.record('crontab', crontab['user'])
 
-    self.rpmdb.run(test=False, reinstall=reinstall)
+    if ('rpm',) not in self.journal:
+      self.rpmdb.run(test=False, reinstall=reinstall)
+      self.journal.record('rpm')
 
     self.callbacks.run_deployment_callbacks()
     self.callbacks.run_post_script()
 
     with open(os.path.join(self.path, self.deploy_file), 'w') as f:
       f.write(self.latest_version())
+    self.__versions['deployed'] = self.latest_version()
+    self.journal.finish()
+    self.manifest.retain(self.new_files)
+
+  def files_to_update(self):
+    '''The common files deploy has to write: the ones show_deployment found
+       modified (every common file if it has not run), less those already
+       matching the newest content and ACL.  Files that only need their ACL
+       set are added to self.acl_only_files.'''
+    if self.inspected:
+      candidates = self.modified
+    else:
+      candidates = self.common_files()
+    updates = []
+    for entry in candidates:
+      content_matches, acl_matches = self.file_state(entry[0], entry[3])
+      if content_matches and acl_matches:
+        continue
+      if content_matches:
+        self.acl_only_files.add(entry[0])
+      updates.append(entry)
+    return updates
+
+  def resumed(self, local, file, new_args):
+    '''True if the interrupted deploy of the same commits already wrote file
+       and it still has that content, which deploy then leaves alone'''
+    if ('install', file) not in self.journal or not local.exists(file):
+      return False
+    if new_args['isdir'] or local.hash(file) == new_args['hash']:
+      self.resumed_files.add(file)
+      return True
+    return False
+
+  def up_to_date(self, file, new_args):
+    'True if file already has the content and ACL of new_args'
+    return self.file_state(file, new_args) == (True, True)
+
+  def file_state(self, file, new_args):
+    '''Whether file has the content and whether it has the ACL of new_args,
+       recording it in the manifest if it has both'''
+    stat_info = self.stats.lstat(file)
+    if stat_info is None:
+      return False, False
+    # the manifest has hash and ACL of files it says are unchanged
+    recorded = self.manifest.get(file, stat_info)
+    if new_args['isdir']:
+      content_matches = self.stats.isdir(file)
+    elif stat.S_ISDIR(stat_info.st_mode):
+      content_matches = False
+    elif recorded is not None:
+      content_matches = recorded[0] == new_args['hash']
+    else:
+      content_matches = self.hasher.hash(file, True, stat_info) == new_args['hash']
+    if not content_matches:
+      return False, False
+    if recorded is not None:
+      return True, recorded[1] == new_args['acl']
+    acl = ACL.from_file(file, stat_info)
+    if acl != new_args['acl']:
+      return True, False
+    self.manifest.record(file, stat_info,
+                         None if new_args['isdir'] else new_args['hash'], acl)
+    return True, True
+
+  def remove_file(self, file, orig_args, backup):
+    '''Delete one file, or move it aside with backup; returns an error
+       message for a directory that could not be removed'''
+    if not self.stats.lexists(file):
+      return None
+    error = None
+    if backup:
+      os.rename(file, '%s.gitman' % file)
+    elif orig_args['isdir']:
+      try:
+        os.rmdir(file)
+      except:
+        error = 'Failed to remove directory: %s' % file
+    else:
+      os.unlink(file)
+    self.stats.invalidate(file, recursive=orig_args['isdir'])
+    if not error:
+      self.manifest.discard(file)
+      self.journal.record('delete', file)
+    return error
+
+  def install_file(self, file, sys_file, new_args, backup, from_objects=False):
+    '''Write one added or updated file, from its blob if from_objects, else
+       from sys_file, keeping self.stats valid'''
+    stats = self.stats
+    dirattr = new_args['dirattr']
+    if dirattr:
+      def created(dir):
+        dirattr.applyto(dir, stats.stat(dir))
+        stats.invalidate(dir)
+    else:
+      created = None
+    self.dirs.ensure(os.path.dirname(file), created)
+    content_fingerprint = None
+    if file in self.resumed_files:
+      # written by the interrupted deploy and unchanged since
+      pass
+    elif file in self.acl_only_files:
+      # the content is already the newest, leave the inode and mtime alone
+      pass
+    elif new_args['isdir']:
+      if stats.stat(file) is None:
+        self.dirs.ensure(file)
+    elif from_objects and new_args.get('blob'):
+      session = gittools.cat_file_session(self.repo)
+      fingerprints = self.manifest.fingerprint
+      digest = fingerprints.digest() if fingerprints is not None else None
+      fs.install(file, lambda tmp_file: gittools.checkout_blob(
+        session, new_args['blob'], new_args['gitmode'], tmp_file, digest), backup)
+      stats.invalidate(file)
+      if digest is not None and new_args['gitmode'] != gittools.SYMLINK_MODE:
+        # taken as the blob was streamed, rather than read back
+        content_fingerprint = fingerprints.value(digest)
+    else:
+      fs.copy(sys_file, file, backup)
+      stats.invalidate(file)
+    self.journal.record('install', file)
+    if not stats.islink(file):
+      new_args['acl'].applyto(file, stats.stat(file))
+      stats.invalidate(file)
+    self.journal.record('acl', file)
+    stat_info = stats.lstat(file)
+    self.manifest.put(file, stat_info,
+                      None if new_args['isdir'] else new_args['hash'],
+                      ACL.from_file(file, stat_info), content_fingerprint)
 
   def check_is_clean(self):
     ##TODO: our current commit needs to be on origin
@@ -812,23 +1111,43 @@ class GitMan:
   def switch_to(self, version):
     self.repo.git.reset('--hard', version)
 
-  def switch_to_head_and_update(self, branch='master'):
-    self.repo.git.fetch()
+  def origin_moved(self, remote='origin'):
+    'True if any branch on remote differs from our remote-tracking ref'
+    heads = dict()
+    for line in self.repo.git.ls_remote('--heads', remote).splitlines():
+      sha, ref = line.split()
+      heads[ref.replace('refs/heads/', 'refs/remotes/%s/' % remote, 1)] = sha
+    tracking = dict()
+    for line in self.repo.git.for_each_ref(
+        '--format=%(objectname) %(refname)', 'refs/remotes/%s/' % remote).splitlines():
+      sha, ref = line.split()
+      tracking[ref] = sha
+    return any(tracking.get(ref) != sha for ref, sha in heads.iteritems())
+
+  def update_head(self, branch='master'):
+    'Fetch and return the commit to deploy; the working tree is left alone'
+    if self.origin_moved():
+      self.repo.git.fetch()
     if branch == 'master':
       branch = self.repo.active_branch.tracking_branch()
     else:
       self.repo.git.checkout(branch)
-    self.switch_to(branch)
+    return gittools.rev_parse(self.repo, branch)
 
   def deployed_version(self):
-    try:
-      with open(os.path.join(self.path, self.deploy_file), 'r') as f:
-        return f.read().rstrip()
-    except:
-      return None
+    if 'deployed' not in self.__versions:
+      try:
+        with open(os.path.join(self.path, self.deploy_file), 'r') as f:
+          self.__versions['deployed'] = f.read().rstrip()
+      except:
+        self.__versions['deployed'] = None
+    return self.__versions['deployed']
 
   def latest_version(self):
-    return self.repo.git.log(self.repo.active_branch.tracking_branch(), '--pretty=tformat:"%H"', '-n', '1')[1:-1]
+    if 'latest' not in self.__versions:
+      self.__versions['latest'] = gittools.rev_parse(
+        self.repo, self.repo.active_branch.tracking_branch())
+    return self.__versions['latest']
 
   def undeployed_revisions(self):
     if not self.deployed_version():
@@ -836,22 +1155,22 @@ class GitMan:
     elif self.deployed_version() == self.latest_version():
       return 0
     else:
-      revision_string = '%s..%s' % (self.deployed_version(), self.repo.active_branch.tracking_branch())
-    return len(self.repo.git.log('--pretty=tformat:"%H"', revision_string).split('\n'))
+      revision_string = '%s..%s' % (self.deployed_version(), self.latest_version())
+    return int(self.repo.git.rev_list('--count', revision_string))
 
-  def load_config(self):
+  def load_config(self, tree, host=None):
     base_path = self.path
     config = {
         'securepath': '/usr/sbin:/usr/bin:/sbin:/bin',
         'root': 'root',
-        'host': self.host,
+        'host': host or self.host,
         'host_dir': 'hosts'
     };
     config['host_file'] = config['host']
     config['short_host'] = config['host'].split('.')[0]
     config['root'] = os.path.join('machines', config['host'])
 
-    with open(os.path.join(base_path, 'config')) as f:
+    with tree.open(os.path.join(base_path, 'config')) as f:
       for line in f:
         if ':' in line:
           key, value = line.split(':', 1)
@@ -861,9 +1180,24 @@ class GitMan:
             config[key] = parse_config(value, config)
     return config;
 
-  def dump_added(self):
-    for file, sys_file, new_args in self.added_files():
-      print 'ADDED:', file
+  def list_hosts(self):
+    'Every file in the host directory, sorted'
+    host_dir = os.path.join(self.path, self.config['host_dir'])
+    try:
+      names = self.tree.listdir(host_dir)
+    except OSError:
+      return []
+    return sorted(name for name in names
+                  if not self.tree.isdir(os.path.join(host_dir, name)))
+
+  def host_info(self, host):
+    '''Compile host against the tree this GitMan was loaded with and return
+       (host file, sorted deployed paths).  Hosts compiled by one GitMan
+       share its tree, hashes and glob results.'''
+    config = self.load_config(self.tree, host)
+    config['host_file'] = host
+    compiled = self.compile_host(config, self.tree)
+    return compiled['host_file'], sorted(entry[0] for entry in compiled['files'])
 
 
 def main():
@@ -880,13 +1214,22 @@ def main():
   parser.add_option('-D', '--deploy', action='store_true', help='Deploy changes')
   parser.add_option('-d', '--repo-path', help='Repo path')
   parser.add_option('-b', '--backup', action='store_true', help='backup files')
+  parser.add_option('--from-objects', action='store_true', help='Deploy files straight from git objects without checking out the working tree')
   parser.add_option('--noacl', action='store_true', help='Disable ACL support')
   parser.add_option('--origin', help='URL for Git Repository origin')
   parser.add_option('--branch', default='master', help='Default: %default')
   parser.add_option('--diffs', action='store_true', help='Show diffs')
-  parser.add_option('--info', metavar='MACHINE', help='Dump deployment info for a machine')
+  parser.add_option('--info', metavar='MACHINE', action='append', help='Dump deployment info for a machine (repeatable)')
+  parser.add_option('--info-all', action='store_true', help='Dump deployment info for every file in the host directory')
+  parser.add_option('--preload-ids', action='store_true', help='Load all users and groups up front rather than resolving them one by one')
+  parser.add_option('--threads', type='int', default=16, help='Threads used to inspect deployed files. Default: %default')
+  parser.add_option('--deploy-threads', type='int', default=1, help='Threads used to write deployed files; with more than one, files already being written when one fails are still finished. Default: %default')
+  parser.add_option('-j', '--jobs', type='int', default=1, help='Processes used to plan --info hosts. Default: %default')
   parser.add_option('--assume-host', metavar='HOSTNAME', help='Assume the given hostname')
   parser.add_option('--holdup-diffs', action='store_true', help='Show holdup diffs')
+  parser.add_option('--full-plan', action='store_true', help='Load the deployed revision in full instead of diffing it against the newest')
+  parser.add_option('--fingerprint', metavar='ALGORITHM', choices=list(fingerprint.ALGORITHMS), help='Digest used to check deployed files against the manifest, one of %s. Default: the first, or none if xxhash is not installed' % ', '.join(fingerprint.ALGORITHMS))
+  parser.add_option('--verify-hash-cache', action='store_true', help='Check cached file hashes against git and exit')
 
   (options, args) = parser.parse_args()
 
@@ -898,7 +1241,7 @@ def main():
   # compilation
   eval(
     compile(
-      'from acl import ACL, has_xacl',
+      'from acl import ACL, has_xacl, ids as acl_ids',
       __file__,
       'single'),
     globals(),
@@ -908,25 +1251,57 @@ def main():
     parser.error('-d/--repo-path required')
   if options.force and not options.deploy:
     parser.error('Cannot force without deployment')
-  if options.info:
+  if options.info_all:
+    options.info = []
+  if options.info is not None:
     if options.quiet or options.deploy or options.backup or options.diffs or options.holdup_diffs:
       parser.error('Cannot use -q/-D/-b/--diffs/--holdup-diffs with --info')
   if options.diffs and options.holdup_diffs:
     parser.error('--diffs and --holdup-diffs should not be used together')
-  verbose = not options.quiet and not options.info
+
+  if options.verify_hash_cache:
+    repo = git.Repo(os.path.abspath(options.repo_path))
+    cache = hashcache.HashCache(os.path.join(repo.git_dir, 'gitman_hashcache'))
+    mismatches = cache.verify(
+      lambda path: repo.git.hash_object(path, with_keep_cwd=True))
+    cache.save()
+    for path, cached, actual in mismatches:
+      ansi.writeout('${BRIGHT_RED}STALE hash: %s cached %s, actual %s${RESET}' %
+                    (path, cached, actual))
+    ansi.writeout('%d cached hashes checked, %d stale' %
+                  (len(cache) + len(mismatches), len(mismatches)))
+    sys.exit(1 if mismatches else 0)
+
+  if options.jobs < 1 or options.threads < 1 or options.deploy_threads < 1:
+    parser.error('-j/--jobs, --threads and --deploy-threads must be at least 1')
+
+  if options.preload_ids:
+    acl_ids.preload()
+
+  verbose = not options.quiet and options.info is None
   gitman = GitMan(
     os.path.abspath(options.repo_path),
     options.origin,
     options.branch,
     assume_host=options.assume_host,
-    info=options.info)
+    info=options.info,
+    plan_from_diff=not options.full_plan,
+    fingerprint_algorithm=options.fingerprint)
+  try:
+    run(gitman, options, verbose)
+  finally:
+    gitman.close()
+
+
+def run(gitman, options, verbose):
   if verbose:
     ansi.writeout('Deployed version: %s' % gitman.deployed_version())
     ansi.writeout('Newest version: %s' % gitman.latest_version())
     ansi.writeout('  %d revisions between deployed and latest' %
                   gitman.undeployed_revisions())
   if options.info is None:
-    holdups, verbose_info, failures = gitman.show_deployment(options.diffs, options.holdup_diffs)
+    holdups, verbose_info, failures = gitman.show_deployment(
+      options.diffs, options.holdup_diffs, options.threads)
     if verbose:
       ansi.writeout('\n'.join(verbose_info))
     if failures:
@@ -940,8 +1315,47 @@ def main():
     if options.deploy:
       if failures:
         sys.exit('Deployment skipped due to failures...')
-      gitman.deploy(backup=options.backup, force=options.force, reinstall=options.reinstall)
+      gitman.deploy(backup=options.backup, force=options.force, reinstall=options.reinstall,
+                    from_objects=options.from_objects, threads=options.deploy_threads)
   else:
-    print 'Showing deployment info for:', gitman.config['host_file']
-    gitman.dump_added()
+    failed = False
+    for host, result, error in host_infos(gitman, options.jobs):
+      if error:
+        ansi.writeout('${BRIGHT_RED}Failed to plan %s: %s${RESET}' % (host, error))
+        failed = True
+        continue
+      host_file, files = result
+      print 'Showing deployment info for:', host_file
+      for file in files:
+        print 'ADDED:', file
+    if failed:
+      sys.exit(1)
+
+
+_info_gitman = None
+
+
+def _host_info(host):
+  try:
+    return host, _info_gitman.host_info(host), None
+  except Exception as e:
+    return host, None, str(e) or e.__class__.__name__
+
+
+def host_infos(gitman, jobs=1):
+  '''Plan every host in gitman.info_hosts, yielding (host, (host file,
+     files), error) in order.  With several jobs the hosts are spread over
+     forked workers that inherit the loaded tree.'''
+  global _info_gitman
+  _info_gitman = gitman
+  hosts = gitman.info_hosts
+  if jobs == 1 or len(hosts) < 2:
+    return itertools.imap(_host_info, hosts)
+  import multiprocessing
+  pool = multiprocessing.Pool(min(jobs, len(hosts)))
+  # chunks keep runs of hosts in one worker, where they share glob results
+  results = pool.map(_host_info, hosts, chunksize=max(1, len(hosts) // (jobs * 4)))
+  pool.close()
+  pool.join()
+  return results
 
@@ -25,12 +25,88 @@ import grp
 
 import pwd
 import stat
+import time
 
 
 class ExtendedACLError(RuntimeError):
   pass
 
 
+class IdCache(object):
+  '''Maps uids and gids to names and back, remembering every answer, the
+     misses included, so each id costs at most one NSS lookup (a network
+     round trip on LDAP/SSSD hosts).  With a ttl, entries are looked up
+     again once they are ttl seconds old.  preload() fills the maps from
+     getpwall()/getgrall() in one go.'''
+
+  def __init__(self, ttl=None):
+    self.ttl = ttl
+    self.clear()
+
+  def clear(self):
+    self.__maps = dict((kind, dict()) for kind in
+                       ('user_name', 'group_name', 'uid', 'gid'))
+
+  def __remember(self, kind, key, value, now=None):
+    expires = None
+    if self.ttl is not None:
+      expires = (now or time.time()) + self.ttl
+    self.__maps[kind][key] = (value, expires)
+
+  def __lookup(self, kind, key, resolve):
+    entry = self.__maps[kind].get(key)
+    if entry is None or (entry[1] is not None and entry[1] < time.time()):
+      try:
+        value = resolve(key)
+      except KeyError:
+        value = KeyError
+      self.__remember(kind, key, value)
+    else:
+      value = entry[0]
+    if value is KeyError:
+      raise KeyError(key)
+    return value
+
+  def preload(self):
+    now = time.time()
+    for entry in pwd.getpwall():
+      if entry.pw_uid not in self.__maps['user_name']:
+        self.__remember('user_name', entry.pw_uid, entry.pw_name, now)
+      if entry.pw_name not in self.__maps['uid']:
+        self.__remember('uid', entry.pw_name, entry.pw_uid, now)
+    for entry in grp.getgrall():
+      if entry.gr_gid not in self.__maps['group_name']:
+        self.__remember('group_name', entry.gr_gid, entry.gr_name, now)
+      if entry.gr_name not in self.__maps['gid']:
+        self.__remember('gid', entry.gr_name, entry.gr_gid, now)
+
+  def user_name(self, uid):
+    'The name of uid, or uid itself if it has none'
+    try:
+      return self.__lookup('user_name', uid, lambda uid: pwd.getpwuid(uid).pw_name)
+    except KeyError:
+      return uid
+
+  def group_name(self, gid):
+    'The name of gid, or gid itself if it has none'
+    try:
+      return self.__lookup('group_name', gid, lambda gid: grp.getgrgid(gid).gr_name)
+    except KeyError:
+      return gid
+
+  def uid(self, name):
+    'The uid of user name, KeyError if there is none'
+    return self.__lookup('uid', name, lambda name: pwd.getpwnam(name).pw_uid)
+
+  def gid(self, name):
+    'The gid of group name, KeyError if there is none'
+    return self.__lookup('gid', name, lambda name: grp.getgrnam(name).gr_gid)
+
+
+# shared by ACL.from_file and ACL.applyto
+ids = IdCache()
+
+
 if has_xacl:
   class posix_acl_wrapper:
     '''Wraps posix1e acl calls to trap exceptions and rethrow something
@@ -52,43 +128,64 @@ if has_xacl:
   posix_acl = posix_acl_wrapper()
 
 
+_interned = dict()
+
+
+def _intern(key, make):
+  acl = _interned.get(key)
+  if acl is None:
+    acl = _interned.setdefault(key, make())
+  return acl
+
+
+def simple_acl(user, group, mode):
+  'The interned SimpleACL for user, group and mode'
+  if mode and type(mode) is not int:
+    mode = int(mode, 8)
+  return _intern((SimpleACL, user, group, mode),
+                 lambda: SimpleACL(user, group, mode))
+
+
 class ACL(object):
+  '''ACLs are immutable values made by the interning factories, from_file(),
+     from_components(), simple_acl() and extended_acl(), which return the
+     same object for the same value.  == checks identity first, and treats
+     an unset user, group or mode as matching anything.'''
+
+  __slots__ = ('__user', '__group')
+
   @staticmethod
-  def from_file(file):
-    if os.path.islink(file):
-      return SymlinkACL()
-    elif not os.path.exists(file):
-      return None
+  def from_file(file, stat_info=None):
+    '''The ACL of file, a SymlinkACL for a symlink or None if there is no
+       file.  stat_info is the lstat() of file if the caller has it.'''
+    if stat_info is None:
+      try:
+        stat_info = os.lstat(file)
+      except OSError:
+        return None
+    if stat.S_ISLNK(stat_info.st_mode):
+      return _SYMLINK_ACL
+    user, group, stat_info = ACL.__get_ownership(file, stat_info)
     try:
       if has_xacl and posix_acl.has_extended(file):
-        return ExtendedACL.__from_file(file)
+        return extended_acl(user, group, ExtendedACL.mode_from_stat(file, stat_info))
     except ExtendedACLError:
       pass
-    return SimpleACL.__from_file(file)
+    return simple_acl(user, group, SimpleACL.mode_from_stat(file, stat_info))
 
   @staticmethod
   def from_components(user=None, group=None, mode=None, xattr=None):
     if has_xacl and xattr:
-      return ExtendedACL(user, group, xattr, mode).simplify()
-    return SimpleACL(user, group, mode)
+      return _intern(('components', user, group, mode, xattr),
+                     lambda: extended_acl(user, group, xattr, mode).simplify())
+    return simple_acl(user, group, mode)
 
   @staticmethod
-  def __get_ownership(file):
-    stat_info = os.stat(file)
-    try:
-      user = pwd.getpwuid(stat_info.st_uid)[0]
-    except KeyError:
-      user = stat_info.st_uid
-    try:
-      group = grp.getgrgid(stat_info.st_gid)[0]
-    except KeyError:
-      group = stat_info.st_gid
-    return user, group, stat_info
-
-  @classmethod
-  def __from_file(klass, file):
-    user, group, stat_info = ACL.__get_ownership(file)
-    return klass(user, group, klass.mode_from_stat(file, stat_info))
+  def __get_ownership(file, stat_info=None):
+    if stat_info is None:
+      stat_info = os.stat(file)
+    return (ids.user_name(stat_info.st_uid), ids.group_name(stat_info.st_gid),
+            stat_info)
 
   def __init__(self, user, group):
     super(ACL, self).__init__()
@@ -123,8 +220,10 @@ class ACL(object):
   def group(self):
     return self.__group
 
-  def applyto(self, file):
-    user, group, stat_info = ACL.__get_ownership(file)
+  def applyto(self, file, stat_info=None):
+    '''Apply to file, whose current os.stat() may be passed in as
+       stat_info; returns the stat_info before any change'''
+    user, group, stat_info = ACL.__get_ownership(file, stat_info)
 
     if self.user and self.user != user:
       need_user = True
@@ -140,15 +239,17 @@ class ACL(object):
     gid = -1
 
     if need_user:
-      uid = pwd.getpwnam(self.user).pw_uid
+      uid = ids.uid(self.user)
       os.chown(file, uid, gid)
     if need_group:
-      gid = grp.getgrnam(self.group).gr_gid
+      gid = ids.gid(self.group)
       os.chown(file, uid, gid)
     return stat_info
 
 
 class SimpleACL(ACL):
+  __slots__ = ('__mode',)
+
   @staticmethod
   def mode_from_stat(file, stat_info):
     return stat.S_IMODE(stat_info.st_mode)
@@ -158,15 +259,18 @@ class SimpleACL(ACL):
     if mode and type(mode) is not int:
       mode = int(mode, 8)
     self.__mode = mode
-  
+
+  def __reduce__(self):
+    return (simple_acl, (self.user, self.group, self.__mode))
+
   def __eq__(self, rhs):
-    return (type(rhs) is SimpleACL and
+    return self is rhs or (type(rhs) is SimpleACL and
             self._ACL__check_user(rhs) and
             self._ACL__check_group(rhs) and
             self._ACL__check_mode(self.__mode, rhs.__mode))
 
   def __ne__(self, rhs):
-    return (type(rhs) is not SimpleACL or
+    return self is not rhs and (type(rhs) is not SimpleACL or
             not self._ACL__check_user(rhs) or
             not self._ACL__check_group(rhs) or
             not self._ACL__check_mode(self.__mode, rhs.__mode))
@@ -183,8 +287,8 @@ class SimpleACL(ACL):
   def extended(self):
     return False
 
-  def applyto(self, file):
-    stat_info = super(SimpleACL, self).applyto(file)
+  def applyto(self, file, stat_info=None):
+    stat_info = super(SimpleACL, self).applyto(file, stat_info)
     if self.__mode and self.__mode != SimpleACL.mode_from_stat(file, stat_info):
       os.chmod(file, self.__mode)
 
@@ -193,7 +297,19 @@ _ACL_TYPES.append(SimpleACL)
 
 
 if has_xacl:
+  def extended_acl(user, group, xattr, chmod=0):
+    '''The interned ExtendedACL for user, group and xattr, a posix1e.ACL or
+       its text form, which is only parsed the first time it is seen'''
+    if type(xattr) is posix1e.ACL:
+      key = (ExtendedACL, user, group, xattr.to_any_text(), None)
+    else:
+      key = (ExtendedACL, user, group, xattr, chmod)
+    return _intern(key, lambda: ExtendedACL(user, group, xattr, chmod))
+
+
   class ExtendedACL(ACL):
+    __slots__ = ('__xattr', '__text')
+
     @staticmethod
     def mode_from_stat(file, stat_info):
       return posix_acl.ACL(file=file)
@@ -221,15 +337,20 @@ if has_xacl:
             xattr.calc_mask()
 
       self.__xattr = xattr
+      self.__text = xattr.to_any_text()
+
+    def __reduce__(self):
+      # posix1e.ACL can't be pickled, its text form can
+      return (extended_acl, (self.user, self.group, self.__text))
 
     def __eq__(self, rhs):
-      return (type(rhs) is ExtendedACL and
+      return self is rhs or (type(rhs) is ExtendedACL and
               self._ACL__check_user(rhs) and
               self._ACL__check_group(rhs) and
               self.__xattr == rhs.__xattr)
 
     def __ne__(self, rhs):
-      return (type(rhs) is not ExtendedACL or
+      return self is not rhs and (type(rhs) is not ExtendedACL or
               not self._ACL__check_user(rhs) or
               not self._ACL__check_group(rhs) or
               self.__xattr != rhs.__xattr)
@@ -254,12 +375,12 @@ if has_xacl:
         if elem.tag_type in (posix1e.ACL_USER, posix1e.ACL_GROUP, posix1e.ACL_MASK):
           return self
       try:
-        return SimpleACL(self.user, self.group, self.__xattr.equiv_mode())
+        return simple_acl(self.user, self.group, self.__xattr.equiv_mode())
       except IOError:
         return self
 
-    def applyto(self, file):
-      super(ExtendedACL, self).applyto(file)
+    def applyto(self, file, stat_info=None):
+      super(ExtendedACL, self).applyto(file, stat_info)
       if self.__xattr:
         try:
           self.__xattr.applyto(file)
@@ -270,8 +391,13 @@ if has_xacl:
 
 
 class SymlinkACL(ACL):
+  __slots__ = ()
+
   def __init__(self):
     pass
+
+  def __reduce__(self):
+    return (symlink_acl, ())
   
   def __eq__(self, rhs):
     return (type(rhs) in _ACL_TYPES)
@@ -287,6 +413,12 @@ class SymlinkACL(ACL):
   def extended(self):
     return False
 
-  def applyto(self, file):
+  def applyto(self, file, stat_info=None):
     return
 
+
+_SYMLINK_ACL = SymlinkACL()
+
+
+def symlink_acl():
+  return _SYMLINK_ACL
@@ -0,0 +1,205 @@
+import os
+import re
+
+
+## Pattern syntax taken from http://code.google.com/p/waf/source/browse/waflib/Node.py
+##
+## Patterns are compiled into lists of segments.  A walk carries a set of
+## (pattern, position) states; each directory's state set is compiled once
+## into a Matcher so that names are matched with a dict lookup for literal
+## segments and a single combined regex as a prefilter for wildcards.
+
+ANY = '**'
+REGEX_CHARS = set('*?[](){}|^$\\')
+
+
+def to_list(sth):
+  if isinstance(sth, str):
+    return sth.split()
+  else:
+    return sth
+
+
+def to_pat(s, reflags=0):
+  'Compile ant patterns into tuples of segments: ANY, a literal name or a regex'
+  ret = []
+  for x in to_list(s):
+    x = x.replace('\\', '/').replace('//', '/')
+    if x.endswith('/'):
+      x += '**'
+    accu = []
+    for k in x.split('/'):
+      if k == ANY:
+        accu.append(ANY)
+      elif not reflags and not REGEX_CHARS.intersection(k):
+        accu.append(k)
+      else:
+        k = k.replace('.', '[.]').replace('*','.*').replace('?', '.').replace('+', '\\+')
+        k = '^%s$' % k
+        try:
+          accu.append(re.compile(k, flags=reflags))
+        except Exception as e:
+          raise Exception('Invalid pattern: %s' % k, e)
+    ret.append(tuple(accu))
+  return ret
+
+
+class Matcher(object):
+  '''A compiled state set.  match(name) returns the Matcher for the states
+     that survive name, or None if there are none.'''
+
+  def __init__(self, sets, states):
+    pats = sets.pats
+    self.sets = sets
+    self.literals = dict()
+    self.regexes = list()
+    self.stay = set()
+    self.ends = list()       # patterns that end here
+    self.live = False        # a pattern can match something deeper
+    self.everything = False  # a trailing ** matches everything deeper
+    for state in states:
+      p, i = state
+      seg = pats[p]
+      if i == len(seg):
+        self.ends.append(p)
+        continue
+      self.live = True
+      if seg[i] is ANY:
+        self.stay.add(state)
+        if i + 1 == len(seg):
+          self.everything = True
+          self.stay.add((p, i + 1))
+        else:
+          self.add(seg[i + 1], (p, i + 2))
+      else:
+        self.add(seg[i], (p, i + 1))
+    self.stay = frozenset(self.stay)
+    self.complete = bool(self.ends)
+    self.last = max(self.ends) if self.ends else None
+    # True if every transition needs a specific name, so a directory can be
+    # probed for those names instead of listed
+    self.literal_only = not self.stay and not self.regexes
+    if len(self.regexes) > 1:
+      self.prefilter = re.compile('|'.join(
+        '(?:%s)' % regex.pattern for regex, state in self.regexes),
+        self.regexes[0][0].flags)
+    else:
+      self.prefilter = None
+    self.__next = dict()
+
+  def add(self, seg, state):
+    if seg is ANY:
+      self.stay.add(state)
+    elif isinstance(seg, str):
+      self.literals.setdefault(seg, set()).add(state)
+    else:
+      self.regexes.append((seg, state))
+
+  def match(self, name):
+    literal = name if name in self.literals else None
+    hits = ()
+    regexes = self.regexes
+    if len(regexes) == 1:
+      if regexes[0][0].match(name):
+        hits = (0,)
+    elif regexes and self.prefilter.match(name):
+      hits = tuple(n for n, (regex, state) in enumerate(regexes)
+                   if regex.match(name))
+    key = (literal, hits)
+    try:
+      return self.__next[key]
+    except KeyError:
+      states = set(self.stay)
+      if literal is not None:
+        states.update(self.literals[literal])
+      states.update(self.regexes[n][1] for n in hits)
+      matcher = self.__next[key] = self.sets[frozenset(states)]
+      return matcher
+
+
+class StateSets(object):
+  '''Compiled patterns plus a Matcher per distinct state set seen during a
+     walk, so each set is only analysed once'''
+
+  def __init__(self, pats):
+    self.pats = pats
+    self.matchers = dict()
+
+  def start(self):
+    return self[frozenset((p, 0) for p in xrange(len(self.pats)))]
+
+  def __getitem__(self, states):
+    if not states:
+      return None
+    matcher = self.matchers.get(states)
+    if matcher is None:
+      matcher = self.matchers[states] = Matcher(self, states)
+    return matcher
+
+
+def walk(start_dir, tree, incl, reject=None, drop=None, maxdepth=25, dropped=None):
+  '''Walk start_dir carrying three pattern sets: paths matching incl are
+     yielded as (path, isdir, index of the last include pattern matching);
+     reject removes a path and everything below it from the walk; drop
+     removes just the paths it matches.  If dropped is a list, every path
+     drop matches is appended to it, which walks subtrees only drop can
+     reach as well.'''
+
+  def start(sets):
+    return sets and sets.start()
+
+  def entries(current_dir, active):
+    if all(m.literal_only for m in active):
+      names = set()
+      for m in active:
+        names.update(m.literals)
+      for name in sorted(names):
+        isdir = tree.probe(os.path.join(current_dir, name))
+        if isdir is not None:
+          yield name, lambda isdir=isdir: isdir
+    else:
+      for entry in sorted(tree.scan(current_dir)):
+        yield entry
+
+  def iterate(current_dir, nincl, nrej, ndrop, maxdepth):
+    active = [m for m in (nincl, ndrop if dropped is not None else None) if m]
+    for name, isdir in entries(current_dir, active):
+      nacc = nincl and nincl.match(name)
+      nout = ndrop and ndrop.match(name)
+      if nacc is None and (dropped is None or nout is None):
+        continue
+      nr = nrej and nrej.match(name)
+      if nr and nr.complete:
+        continue
+      abspath = os.path.join(current_dir, name)
+      isdir = isdir()
+      if nout and nout.complete:
+        if dropped is not None:
+          dropped.append(abspath)
+      elif nacc and nacc.complete:
+        yield abspath, isdir, nacc.last
+      if not isdir or not maxdepth or (nr and nr.everything):
+        continue
+      if ((nacc and nacc.live and not (nout and nout.everything)) or
+          (dropped is not None and nout and nout.live)):
+        for k in iterate(abspath, nacc, nr, nout, maxdepth - 1):
+          yield k
+
+  nincl = start(incl)
+  if nincl is None and (dropped is None or drop is None):
+    return iter(())
+  return iterate(start_dir, nincl, start(reject), start(drop), maxdepth)
+
+
+def ant_rules(start_dir, includes, excludes, tree, maxdepth=25, dropped=None):
+  '''Evaluate a list of include patterns and a list of exclude patterns in
+     a single walk of start_dir in tree, a gittools.PathTree: returns (path,
+     isdir, n) for every file and folder some include matches and no exclude
+     does, n being the index in includes of the last include matching.
+     .git and .gitignore are never matched.  Subtrees an exclude covers
+     entirely are pruned.  See walk() for dropped.'''
+  return list(walk(start_dir, tree,
+                   StateSets(to_pat(list(includes))),
+                   StateSets(to_pat(['.git', '.gitignore'])),
+                   StateSets(to_pat(list(excludes))),
+                   maxdepth=maxdepth, dropped=dropped))
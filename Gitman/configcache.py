@@ -0,0 +1,60 @@
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+import hashlib
+import os
+import zlib
+
+
+class ConfigCache(object):
+  '''On-disk cache of compiled host configs, one file per key.
+
+     Each entry records the git object id of every repo path it was compiled
+     from (the config, the host file and its imports, crontabs and the tree
+     of every root) and is only returned while all of them are unchanged.
+     Missing paths are recorded as None, so a file appearing invalidates the
+     entry as well.'''
+
+  VERSION = 3
+
+  def __init__(self, directory):
+    self.directory = directory
+
+  def __filename(self, key):
+    return os.path.join(self.directory, hashlib.sha1(repr(key)).hexdigest())
+
+  def get(self, key, object_id):
+    '''Return the value stored for key, or None if there is none or one of
+       its dependencies changed.  object_id(path) gives the current id of a
+       repo path.'''
+    try:
+      with open(self.__filename(key), 'rb') as f:
+        version, stored_key, deps, value = pickle.loads(zlib.decompress(f.read()))
+    except Exception:
+      return None
+    if version != ConfigCache.VERSION or stored_key != key:
+      return None
+    for path, sha in deps:
+      if object_id(path) != sha:
+        return None
+    return value
+
+  def put(self, key, deps, value):
+    'Store value for key along with a list of (path, object id) it depends on'
+    filename = self.__filename(key)
+    tmp = filename + '.tmp'
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+      data = pickle.dumps((ConfigCache.VERSION, key, deps, value),
+                          pickle.HIGHEST_PROTOCOL)
+      with open(tmp, 'wb') as f:
+        f.write(zlib.compress(data, 1))
+      os.rename(tmp, filename)
+    except (IOError, OSError, TypeError, pickle.PicklingError):
+      try:
+        os.unlink(tmp)
+      except OSError:
+        pass
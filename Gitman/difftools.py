@@ -1,21 +1,19 @@
+import gittools
+
 import difflib
 import os
-import re
-
-
-def git_ls_tree(repo, path, rev='HEAD'):
-  ls = repo.git.ls_tree('-r', rev, path)
-  return re.split('\s+', ls)
 
 
 def git_catfile(repo, path, rev='HEAD'):
-  x = git_ls_tree(repo, path, rev)
-  if len(x) == 1 and x[0] == '':
+  data = gittools.cat_file_session(repo).read('%s:%s' % (rev, path))
+  if data is None:
     # non-existant file at the given rev
     return ''
-  (mode, objtype, obj, fl) = x
-  return repo.git.cat_file('-p', obj)
-  
+  # match the output of `git cat-file -p` as returned by GitPython
+  if data.endswith('\n'):
+    data = data[:-1]
+  return data
+
 
 def get_diff(file1, file2, repo, rev1=None, rev2=None, gitbasedir='', prefixa='deployed', prefixb='newest'):
   reponame = os.path.basename(repo.working_dir)
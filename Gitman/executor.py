@@ -0,0 +1,71 @@
+from multiprocessing.pool import ThreadPool
+
+import collections
+import sys
+import threading
+
+
+def depth(path):
+  return path.rstrip('/').count('/')
+
+
+class LevelExecutor(object):
+  '''Runs an action on paths in directory order with a bounded pool of
+     threads.  Every path of one depth is done before any path of the next,
+     so parents come before their children (or after them, bottom_up),
+     while the paths of a single depth, which can't contain each other, run
+     concurrently.
+
+     Once an action raises, items that have not started yet are skipped.
+     The ones already running are let finish and then the exception of the
+     first failing item, in the order given, is re-raised.'''
+
+  def __init__(self, threads=1):
+    self.threads = threads
+    self.__pool = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def close(self):
+    if self.__pool:
+      self.__pool.close()
+      self.__pool.join()
+      self.__pool = None
+
+  @staticmethod
+  def __call(action, item, failed):
+    if failed.is_set():
+      return None, None
+    try:
+      return action(item), None
+    except Exception:
+      failed.set()
+      return None, sys.exc_info()
+
+  def run(self, items, action, path=lambda item: item[0], bottom_up=False):
+    '''Call action(item) for every item, returning the results in the order
+       of items.  path(item) gives the path an item works on.'''
+    levels = collections.defaultdict(list)
+    for n, item in enumerate(items):
+      levels[depth(path(item))].append((n, item))
+    results = [None] * len(items)
+    failed = threading.Event()
+    for level in sorted(levels, reverse=bottom_up):
+      batch = levels[level]
+      if self.threads > 1 and len(batch) > 1:
+        if self.__pool is None:
+          self.__pool = ThreadPool(self.threads)
+        outcomes = self.__pool.map(
+          lambda entry: LevelExecutor.__call(action, entry[1], failed), batch,
+          chunksize=1)
+      else:
+        outcomes = [(action(item), None) for n, item in batch]
+      for (n, item), (result, error) in zip(batch, outcomes):
+        if error:
+          raise error[0], error[1], error[2]
+        results[n] = result
+    return results
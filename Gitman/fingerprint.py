@@ -0,0 +1,104 @@
+try:
+  import xxhash
+except ImportError:
+  xxhash = None
+
+import githash
+
+import collections
+import hashlib
+import os
+
+
+# Only non-cryptographic digests are worth taking on top of blob ids: with
+# OpenSSL, sha1 outruns md5 and blake2b, so those would make drift checks
+# slower rather than faster.  Fastest first.
+ALGORITHMS = collections.OrderedDict()
+if xxhash is not None:
+  if hasattr(xxhash, 'xxh3_64'):
+    ALGORITHMS['xxh3_64'] = xxhash.xxh3_64
+  ALGORITHMS['xxh64'] = xxhash.xxh64
+
+
+class Fingerprint(object):
+  '''Fingerprints file content for comparing a file with a value gitman
+     recorded itself, where it need not be a git blob id.  Anything
+     compared with the repo keeps using blob ids.  Fingerprints are prefixed
+     with the algorithm's name, so ones taken with another algorithm never
+     match.
+
+     Fingerprints are taken from data read anyway: while a blob is streamed
+     to disk, see digest(), or along with the blob id, see hash_file().  Only
+     when git works out blob ids does check() read for a fingerprint alone.'''
+
+  def __init__(self, name=None):
+    if name is None and ALGORITHMS:
+      name = next(iter(ALGORITHMS))
+    if name not in ALGORITHMS:
+      raise RuntimeError('Unknown fingerprint algorithm %s, available: %s' %
+                         (name, ', '.join(ALGORITHMS) or 'none'))
+    self.name = name
+    self.__new = ALGORITHMS[name]
+
+  def digest(self):
+    'A digest to feed content to, see value()'
+    return self.__new()
+
+  def value(self, digest):
+    return '%s:%s' % (self.name, digest.hexdigest())
+
+  def owns(self, fingerprint):
+    'Whether fingerprint was taken with this algorithm'
+    return fingerprint is not None and fingerprint.startswith(self.name + ':')
+
+  def hash_file(self, path):
+    '(blob id, fingerprint) of the regular file path, read once'
+    digest = self.__new()
+    return githash.blob_hash(path, digest), self.value(digest)
+
+  def check(self, path, blob=True):
+    '''(fingerprint, blob id) of the regular file path, read once.  The blob
+       id is None unless blob is set.'''
+    if blob:
+      hash, value = self.hash_file(path)
+      return value, hash
+    digest, = githash.update_from_file(path, lambda size: [self.__new()])
+    return self.value(digest), None
+
+
+if __name__ == '__main__':
+  # usage: fingerprint.py [MB]
+  # compare fingerprint throughput with git blob ids on a file of MB
+  # megabytes, which is read once beforehand so it comes from the page cache.
+  # How sha1 compares depends on the build: with OpenSSL it is faster than
+  # md5 and blake2b, which is why only xxhash is used.
+  import sys
+  import tempfile
+  import time
+
+  size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+  fd, path = tempfile.mkstemp()
+  try:
+    block = os.urandom(githash.CHUNK_SIZE)
+    with os.fdopen(fd, 'wb') as f:
+      for i in xrange(size):
+        f.write(block)
+    githash.blob_hash(path)
+
+    def measure(name, func):
+      start = time.time()
+      func(path)
+      elapsed = time.time() - start
+      print '%-22s %8.0f MB/s' % (name, size / elapsed)
+
+    print sys.version.split('\n')[0]
+    measure('git blob', githash.blob_hash)
+    for name in ('md5', 'sha1'):
+      measure(name, lambda path: githash.update_from_file(
+        path, lambda size: [hashlib.new(name)]))
+    for name in ALGORITHMS:
+      fingerprint = Fingerprint(name)
+      measure(name, lambda path: fingerprint.check(path, False))
+      measure('git blob + ' + name, fingerprint.hash_file)
+  finally:
+    os.unlink(path)
@@ -1,6 +1,34 @@
+import errno
 import os
 import os.path
 import shutil
+import stat
+import threading
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+try:
+  from os import sendfile
+except ImportError:
+  try:
+    from sendfile import sendfile
+  except ImportError:
+    sendfile = None
+
+copy_file_range = getattr(os, 'copy_file_range', None)
+
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+CHUNK_SIZE = 1 << 30
+BUFFER_SIZE = 1 << 20
+
+# errors that mean a fast path is unavailable here, not that the copy failed
+_FALLBACK_ERRNOS = set(getattr(errno, name) for name in
+                       ('EXDEV', 'EINVAL', 'ENOSYS', 'EOPNOTSUPP', 'ENOTSUP',
+                        'ENOTTY', 'EBADF', 'EPERM', 'ETXTBSY')
+                       if hasattr(errno, name))
 
 
 def rmf(f):
@@ -10,6 +38,75 @@ def rmf(f):
     pass
 
 
+def _reflink(fsrc, fdst, size):
+  if fcntl is None:
+    return False
+  fcntl.ioctl(fdst, FICLONE, fsrc)
+  return True
+
+
+def _copy_range(fsrc, fdst, size):
+  if copy_file_range is None:
+    return False
+  copied = 0
+  while copied < size:
+    n = copy_file_range(fsrc, fdst, min(size - copied, CHUNK_SIZE))
+    if n == 0:
+      return False
+    copied += n
+  return True
+
+
+def _sendfile(fsrc, fdst, size):
+  if sendfile is None:
+    return False
+  copied = 0
+  while copied < size:
+    n = sendfile(fdst, fsrc, copied, min(size - copied, CHUNK_SIZE))
+    if n == 0:
+      return False
+    copied += n
+  return True
+
+
+def _read_write(fsrc, fdst, size):
+  while True:
+    data = os.read(fsrc, BUFFER_SIZE)
+    if not data:
+      return True
+    while data:
+      data = data[os.write(fdst, data):]
+
+
+def copy_data(src, dst):
+  '''Copy the content and permission bits of src to a new file dst, sharing
+     extents with a FICLONE reflink if the filesystem can, else copying in
+     the kernel with copy_file_range() or sendfile(), else by read/write.'''
+  fsrc = os.open(src, os.O_RDONLY)
+  try:
+    size = os.fstat(fsrc).st_size
+    fdst = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+    try:
+      for method in (_reflink, _copy_range, _sendfile, _read_write):
+        if not size and method is not _read_write:
+          continue
+        try:
+          if method(fsrc, fdst, size):
+            break
+        except (IOError, OSError) as e:
+          if e.errno not in _FALLBACK_ERRNOS or method is _read_write:
+            raise
+        # start the next method afresh
+        os.lseek(fsrc, 0, os.SEEK_SET)
+        os.lseek(fdst, 0, os.SEEK_SET)
+        os.ftruncate(fdst, 0)
+      os.fchmod(fdst, stat.S_IMODE(os.fstat(fsrc).st_mode))
+    finally:
+      os.close(fdst)
+  finally:
+    os.close(fsrc)
+
+
 def copy_or_remove(src, dst):
   'Copy src to dst, or remove dst on failure'
   if os.path.islink(src):
@@ -17,12 +114,22 @@ def copy_or_remove(src, dst):
     os.symlink(l, dst)
   else:
     try:
-      shutil.copy(src, dst)
+      copy_data(src, dst)
     except:
       rmf(dst)
       raise
 
 
+def link_or_copy(src, dst):
+  '''Hardlink src (or a symlink itself) to dst, copying if the filesystem
+     refuses'''
+  rmf(dst)
+  try:
+    os.link(src, dst)
+  except OSError:
+    copy_or_remove(src, dst)
+
+
 def move_or_remove(src, dst):
   'Move src to dst, or remove src on failure'
   try:
@@ -32,17 +139,135 @@ def move_or_remove(src, dst):
     raise
 
 
-def copy(src, dst, backup=False, backup_ext='.gitman'):
+class StatSnapshot(object):
+  '''One lstat() per path for the length of a run.
+
+     Hashing, ACL comparison and the deploy ask the snapshot rather than the
+     filesystem.  The rule for writes is that whatever creates, replaces,
+     renames, removes or chmods/chowns a path must invalidate() it before it
+     is looked at again, and a directory renamed with paths below it still
+     in use with invalidate(path, recursive=True).  Directories are best
+     created through a DirCache, which keeps the snapshot valid.'''
+
+  def __init__(self):
+    self.__lstats = dict()
+    self.__stats = dict()
+
+  def lstat(self, path):
+    'The lstat() of path, or None if it does not exist'
+    try:
+      return self.__lstats[path]
+    except KeyError:
+      pass
+    try:
+      stat_info = os.lstat(path)
+    except OSError:
+      stat_info = None
+    self.__lstats[path] = stat_info
+    return stat_info
+
+  def stat(self, path):
+    'The stat() of path, following a symlink, or None'
+    stat_info = self.lstat(path)
+    if stat_info is None or not stat.S_ISLNK(stat_info.st_mode):
+      return stat_info
+    try:
+      return self.__stats[path]
+    except KeyError:
+      pass
+    try:
+      target_info = os.stat(path)
+    except OSError:
+      target_info = None
+    self.__stats[path] = target_info
+    return target_info
+
+  def lexists(self, path):
+    return self.lstat(path) is not None
+
+  def islink(self, path):
+    stat_info = self.lstat(path)
+    return stat_info is not None and stat.S_ISLNK(stat_info.st_mode)
+
+  def isdir(self, path):
+    stat_info = self.stat(path)
+    return stat_info is not None and stat.S_ISDIR(stat_info.st_mode)
+
+  def invalidate(self, path, recursive=False):
+    self.__lstats.pop(path, None)
+    self.__stats.pop(path, None)
+    if recursive:
+      prefix = path.rstrip('/') + '/'
+      for cache in (self.__lstats, self.__stats):
+        for cached in [p for p in list(cache) if p.startswith(prefix)]:
+          del cache[cached]
+
+
+class DirCache(object):
+  '''The directories known to exist during a deploy, on top of a
+     StatSnapshot.  ensure() creates whatever part of a directory chain is
+     missing, once, calling created(dir) for every directory it makes from
+     the top down, and no directory is looked at twice.  Safe to share
+     between threads.'''
+
+  def __init__(self, stats):
+    self.stats = stats
+    self.__known = set()
+    self.__lock = threading.Lock()
+
+  def ensure(self, path, created=None):
+    if path in self.__known:
+      return
+    with self.__lock:
+      missing = []
+      parent = path
+      while parent and parent != '/' and parent not in self.__known:
+        if self.stats.isdir(parent):
+          break
+        missing.append(parent)
+        parent = os.path.dirname(parent)
+      for dir in reversed(missing):
+        try:
+          os.mkdir(dir)
+        except OSError as e:
+          if e.errno != errno.EEXIST or not os.path.isdir(dir):
+            raise
+          continue
+        finally:
+          self.stats.invalidate(dir)
+        if created:
+          created(dir)
+      while path != parent:
+        self.__known.add(path)
+        path = os.path.dirname(path)
+      if parent:
+        self.__known.add(parent)
+
+
+def install(dst, fill, backup=False, backup_ext='.gitman'):
+  '''Install a new dst by having fill(tmp) create dst.tmp and renaming it
+     over dst, which is atomic.  With backup the old dst is kept as
+     dst.gitman; it is hardlinked rather than copied, since the rename
+     replaces dst instead of writing to it.'''
   backup_file = dst + backup_ext
   backup_tmp = backup_file + '.tmp'
   tmp_file = dst + '.tmp'
 
-  if os.path.exists(dst) and backup:
-    copy_or_remove(dst, backup_tmp)
-  copy_or_remove(src, tmp_file)
+  backed_up = backup and os.path.exists(dst)
+  if backed_up:
+    link_or_copy(dst, backup_tmp)
+  rmf(tmp_file)
+  try:
+    fill(tmp_file)
+  except:
+    rmf(tmp_file)
+    raise
 
-  if backup:
+  if backed_up:
     move_or_remove(backup_tmp, backup_file)
 
   move_or_remove(tmp_file, dst)
 
+
+def copy(src, dst, backup=False, backup_ext='.gitman'):
+  install(dst, lambda tmp_file: copy_or_remove(src, tmp_file), backup, backup_ext)
@@ -0,0 +1,131 @@
+import hashlib
+import mmap
+import os
+import stat
+import subprocess
+import threading
+
+
+CHUNK_SIZE = 1 << 20
+MMAP_THRESHOLD = 16 << 20
+
+
+def update_from_file(path, digests):
+  '''Feed the content of the regular file path to each of the digests that
+     digests(size) returns, and return them.  Large files are mapped rather
+     than read so they are never copied into Python memory.'''
+  with open(path, 'rb') as f:
+    size = os.fstat(f.fileno()).st_size
+    digests = digests(size)
+    if size >= MMAP_THRESHOLD:
+      m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+      try:
+        for digest in digests:
+          digest.update(m)
+      finally:
+        m.close()
+    else:
+      while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+          break
+        for digest in digests:
+          digest.update(chunk)
+  return digests
+
+
+def blob_hash(path, *digests):
+  '''Compute the git blob id of a regular file in-process, feeding its
+     content to any further digests in the same read'''
+  return update_from_file(
+    path, lambda size: [hashlib.sha1('blob %d\0' % size)] + list(digests))[0].hexdigest()
+
+
+class HashObjectProcess(object):
+  'A long-lived `git hash-object --stdin-paths` process'
+
+  def __init__(self, work_tree):
+    self.work_tree = work_tree
+    self.__proc = None
+    self.__lock = threading.Lock()
+
+  def __start(self):
+    self.__proc = subprocess.Popen(
+      ['git', 'hash-object', '--stdin-paths'],
+      cwd=self.work_tree, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+  def hash(self, path):
+    with self.__lock:
+      if self.__proc is None:
+        self.__start()
+      self.__proc.stdin.write(path + '\n')
+      self.__proc.stdin.flush()
+      line = self.__proc.stdout.readline()
+      if not line:
+        rc = self.close()
+        raise RuntimeError('git hash-object failed on %s (exit %s)' % (path, rc))
+      return line.rstrip('\n')
+
+  def close(self):
+    rc = None
+    if self.__proc:
+      self.__proc.stdin.close()
+      rc = self.__proc.wait()
+      self.__proc = None
+    return rc
+
+  def __del__(self):
+    self.close()
+
+
+class BlobHasher(object):
+  '''Hashes files the way GitMan.hash_file always has: symlinks hash to their
+     target, empty files to 0 and everything else to its git blob id.
+
+     Blob ids are computed in-process unless use_git is set, in which case
+     they come from a single `git hash-object --stdin-paths` process so that
+     clean filters and autocrlf are honoured.'''
+
+  def __init__(self, work_tree, cache=None, use_git=False):
+    self.cache = cache
+    self.use_git = use_git
+    self.__git = HashObjectProcess(work_tree)
+
+  def __special(self, path, stat_info):
+    if stat.S_ISLNK(stat_info.st_mode):
+      return os.readlink(path)
+    if stat_info.st_size == 0:
+      return 0
+    return None
+
+  def __compute(self, path):
+    if self.use_git and '\n' not in path:
+      return self.__git.hash(path)
+    return blob_hash(path)
+
+  def lookup(self, path, stat_info):
+    'The hash of path if it needs no reading or is cached, else None'
+    hash = self.__special(path, stat_info)
+    if hash is None and self.cache is not None:
+      hash = self.cache.get(path, stat_info)
+    return hash
+
+  def store(self, path, stat_info, hash):
+    'Remember a blob id computed elsewhere for path'
+    if self.cache is not None:
+      self.cache.put(path, stat_info, hash)
+
+  def hash(self, path, cache=True, stat_info=None):
+    if stat_info is None:
+      stat_info = os.lstat(path)
+    if not cache:
+      hash = self.__special(path, stat_info)
+      return self.__compute(path) if hash is None else hash
+    hash = self.lookup(path, stat_info)
+    if hash is None:
+      hash = self.__compute(path)
+      self.store(path, stat_info, hash)
+    return hash
+
+  def close(self):
+    self.__git.close()
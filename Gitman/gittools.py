@@ -0,0 +1,381 @@
+import collections
+import errno
+import hashlib
+import io
+import os
+import re
+import subprocess
+import threading
+
+
+EMPTY_BLOB = 'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391'
+SYMLINK_MODE = '120000'
+EXECUTABLE_MODE = '100755'
+OBJECT_ID_RE = re.compile('^[0-9a-f]{40}$')
+STREAM_CHUNK = 1 << 20
+
+
+TreeEntry = collections.namedtuple('TreeEntry', 'mode type sha')
+DiffEntry = collections.namedtuple(
+  'DiffEntry', 'old_mode new_mode old_sha new_sha status path')
+
+# Output of git commands that list paths is taken as bytes rather than the
+# unicode GitPython decodes it to, so that managed paths are byte strings as
+# they would be from os.listdir() and work under any locale.
+RAW = dict(stdout_as_string=False)
+
+
+def rev_parse(repo, rev):
+  'The object id rev names, as a byte string'
+  return repo.git.rev_parse(rev, **RAW)
+
+
+def ls_tree(repo, rev='HEAD', *paths, **kw):
+  '''Return {path: TreeEntry} for every blob below paths at rev, and every
+     tree as well if trees=True.  Paths are relative to the top of the
+     working tree.'''
+  trees = kw.get('trees', False)
+  entries = dict()
+  args = ['-r', '-z']
+  if trees:
+    args.append('-t')
+  out = repo.git.ls_tree(*(args + [rev, '--'] + list(paths)), **RAW)
+  for record in out.split('\0'):
+    if not record:
+      continue
+    meta, path = record.split('\t', 1)
+    mode, objtype, sha = meta.split()
+    if objtype != 'blob' and not (trees and objtype == 'tree'):
+      continue
+    entries[path] = TreeEntry(mode, objtype, sha)
+  return entries
+
+
+def ls_files(repo, *paths):
+  'Return {path: TreeEntry} for every file in the index below paths'
+  entries = dict()
+  out = repo.git.ls_files('-s', '-z', '--', *paths, **RAW)
+  for record in out.split('\0'):
+    if not record:
+      continue
+    meta, path = record.split('\t', 1)
+    mode, sha, stage = meta.split()
+    entries[path] = TreeEntry(mode, 'blob', sha)
+  return entries
+
+
+def existing_paths(repo, rev, paths):
+  '''Return the subset of paths (files or directories) that exist at rev.
+     Each path is looked up exactly as rev:path; pathspecs would not do,
+     since ls-tree lists what is below a directory rather than the
+     directory itself once a path inside it is given too.'''
+  session = cat_file_session(repo)
+  return set(path for path in paths
+             if session.info('%s:%s' % (rev, path)) is not None)
+
+
+def diff_tree(repo, rev1, rev2, *paths):
+  'Return a list of DiffEntry for every file that differs between two revs'
+  entries = list()
+  fields = iter(repo.git.diff_tree('-r', '-z', '--no-renames',
+                                   rev1, rev2, '--', *paths, **RAW).split('\0'))
+  for meta in fields:
+    if not meta:
+      continue
+    path = next(fields)
+    old_mode, new_mode, old_sha, new_sha, status = meta.lstrip(':').split()
+    entries.append(DiffEntry(old_mode, new_mode, old_sha, new_sha, status[0], path))
+  return entries
+
+
+def object_hash(mode, sha, read_link):
+  '''Convert a blob to the value GitMan.hash_file gives the checked out
+     file: the target for symlinks, 0 for empty files, else the blob id.
+     read_link() is called to get a symlink's target.'''
+  if mode == SYMLINK_MODE:
+    return read_link()
+  if sha == EMPTY_BLOB:
+    return 0
+  return sha
+
+
+def entry_hash(entry, read_link):
+  return object_hash(entry.mode, entry.sha, read_link)
+
+
+def _true():
+  return True
+
+
+def _false():
+  return False
+
+
+class PathTree(object):
+  '''An in-memory directory tree built from a list of file paths, which
+     antglob walks.  Directories are implied by the paths below them.  Paths are normalised, so a/./b and a/c/../b are a/b as
+     they would be on disk.'''
+
+  def __init__(self, paths):
+    self.__dirs = dict()
+    for path in paths:
+      path = os.path.normpath(path)
+      while True:
+        parent, name = os.path.split(path)
+        if not name:
+          break
+        known = parent in self.__dirs
+        self.__dirs.setdefault(parent, set()).add(name)
+        if known:
+          break
+        path = parent
+
+  def listdir(self, path):
+    try:
+      return list(self.__dirs[os.path.normpath(path)])
+    except KeyError:
+      raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+  def isdir(self, path):
+    return os.path.normpath(path) in self.__dirs
+
+  def exists(self, path):
+    path = os.path.normpath(path)
+    parent, name = os.path.split(path)
+    return path in self.__dirs or name in self.__dirs.get(parent, ())
+
+  def scan(self, path):
+    'List (name, isdir) pairs, isdir() telling whether name is a directory'
+    dir = os.path.normpath(path)
+    return [(name, _true if os.path.join(dir, name) in self.__dirs else _false)
+            for name in self.listdir(path)]
+
+  def probe(self, path):
+    'None if path does not exist, else whether it is a directory'
+    if self.isdir(path):
+      return True
+    if self.exists(path):
+      return False
+    return None
+
+
+class GitTree(PathTree):
+  '''A read-only view of the tree of a revision, addressed by the paths the
+     files would have in the working tree.  The listing comes from a single
+     ls-tree and content from the shared cat-file session, so nothing is
+     checked out.'''
+
+  def __init__(self, repo, rev):
+    self.repo = repo
+    self.rev = rev_parse(repo, rev)
+    self.entries = dict()
+    self.tree_ids = {repo.working_dir: rev_parse(repo, self.rev + '^{tree}')}
+    for path, entry in ls_tree(repo, self.rev, trees=True).iteritems():
+      path = os.path.join(repo.working_dir, path)
+      if entry.type == 'tree':
+        self.tree_ids[path] = entry.sha
+      else:
+        self.entries[path] = entry
+    super(GitTree, self).__init__(self.entries)
+
+  def object_id(self, path):
+    'The id of the blob or tree at path, or None if there is none'
+    path = os.path.normpath(path)
+    entry = self.entries.get(path)
+    if entry is not None:
+      return entry.sha
+    return self.tree_ids.get(path)
+
+  def read(self, path):
+    entry = self.entries.get(os.path.normpath(path))
+    if entry is None:
+      raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+    return cat_file_session(self.repo).read(entry.sha)
+
+  def open(self, path, mode='r'):
+    return io.BytesIO(self.read(path))
+
+  def islink(self, path):
+    entry = self.entries.get(os.path.normpath(path))
+    return entry is not None and entry.mode == SYMLINK_MODE
+
+  def hash(self, path):
+    'The value GitMan.hash_file would give path once checked out'
+    entry = self.entries[os.path.normpath(path)]
+    return entry_hash(entry, lambda: self.read(path))
+
+
+class IndexTree(PathTree):
+  '''The files git tracks in the working tree, listed from the index with a
+     single ls-files.  Globbing never touches the disk and untracked files
+     are invisible; content is read from the working tree.'''
+
+  def __init__(self, repo):
+    self.repo = repo
+    self.entries = dict(
+      (os.path.join(repo.working_dir, path), entry)
+      for path, entry in ls_files(repo).iteritems())
+    super(IndexTree, self).__init__(self.entries)
+
+  open = staticmethod(open)
+
+  def islink(self, path):
+    entry = self.entries.get(os.path.normpath(path))
+    return entry is not None and entry.mode == SYMLINK_MODE
+
+  def hash(self, path):
+    'The hash of path as staged in the index'
+    entry = self.entries[os.path.normpath(path)]
+    return entry_hash(entry, lambda: os.readlink(path))
+
+
+class CatFileBatch(object):
+  '''A persistent `git cat-file --batch` session.  Objects are requested as
+     anything git rev-parse understands, usually rev:path.  Recently read
+     blobs are kept in an LRU bounded by cache_bytes; rev:path names are
+     only memoized when rev is a full object id, since branch names move.'''
+
+  def __init__(self, work_tree, cache_bytes=32 << 20):
+    self.work_tree = work_tree
+    self.cache_bytes = cache_bytes
+    self.__proc = None
+    self.__blobs = collections.OrderedDict()
+    self.__blob_bytes = 0
+    self.__names = dict()
+
+  def __start(self):
+    self.__proc = subprocess.Popen(
+      ['git', 'cat-file', '--batch'],
+      cwd=self.work_tree, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+  def __remember(self, sha, data):
+    if len(data) > self.cache_bytes:
+      return
+    self.__blobs[sha] = data
+    self.__blob_bytes += len(data)
+    while self.__blob_bytes > self.cache_bytes:
+      old_sha, old_data = self.__blobs.popitem(last=False)
+      self.__blob_bytes -= len(old_data)
+
+  def __lookup(self, sha):
+    data = self.__blobs.pop(sha, None)
+    if data is not None:
+      self.__blobs[sha] = data
+    return data
+
+  def __request(self, name):
+    if self.__proc is None:
+      self.__start()
+    if isinstance(name, unicode):
+      # GitPython decodes paths as UTF-8, git wants the bytes back
+      name = name.encode('utf-8')
+    self.__proc.stdin.write(name + '\n')
+    self.__proc.stdin.flush()
+    line = self.__proc.stdout.readline()
+    if not line:
+      self.close()
+      raise RuntimeError('git cat-file exited while reading %s' % name)
+    fields = line.split()
+    if len(fields) != 3:
+      return None
+    return fields[0], fields[1], int(fields[2])
+
+  def read(self, name):
+    'Return the content of the named object, or None if it does not exist'
+    sha = self.__names.get(name)
+    if sha:
+      data = self.__lookup(sha)
+      if data is not None:
+        return data
+    if OBJECT_ID_RE.match(name):
+      data = self.__lookup(name)
+      if data is not None:
+        return data
+    hdr = self.__request(name)
+    if hdr is None:
+      return None
+    sha, objtype, size = hdr
+    data = self.__proc.stdout.read(size)
+    self.__proc.stdout.read(1)
+    if OBJECT_ID_RE.match(name.split(':', 1)[0]):
+      self.__names[name] = sha
+    if objtype == 'blob':
+      self.__remember(sha, data)
+    return data
+
+  def info(self, name):
+    '(sha, type, size) of the named object, or None if it does not exist'
+    hdr = self.__request(name)
+    if hdr is not None:
+      self.__proc.stdout.read(hdr[2] + 1)
+    return hdr
+
+  def stream(self, sha, out, fingerprint=None):
+    '''Write blob sha to the file object out in chunks, checking the data
+       against sha as it goes and feeding it to the fingerprint digest if
+       one is given.  Returns the size written.'''
+    hdr = self.__request(sha)
+    if hdr is None:
+      raise RuntimeError('git object %s does not exist' % sha)
+    found, objtype, size = hdr
+    if objtype != 'blob':
+      self.__proc.stdout.read(size + 1)
+      raise RuntimeError('git object %s is a %s, not a blob' % (sha, objtype))
+    digest = hashlib.sha1('blob %d\0' % size)
+    remaining = size
+    try:
+      while remaining:
+        chunk = self.__proc.stdout.read(min(remaining, STREAM_CHUNK))
+        if not chunk:
+          raise RuntimeError('git cat-file exited while reading %s' % sha)
+        digest.update(chunk)
+        if fingerprint is not None:
+          fingerprint.update(chunk)
+        out.write(chunk)
+        remaining -= len(chunk)
+      self.__proc.stdout.read(1)
+    except:
+      # the rest of the object is still in the pipe
+      self.__proc.kill()
+      self.close()
+      raise
+    if digest.hexdigest() != found:
+      raise RuntimeError('git object %s read back as %s' % (found, digest.hexdigest()))
+    return size
+
+  def close(self):
+    if self.__proc:
+      self.__proc.stdin.close()
+      self.__proc.wait()
+      self.__proc = None
+
+
+def checkout_blob(session, sha, mode, path, fingerprint=None):
+  '''Create path from blob sha with git's tree mode: a symlink, or a file
+     that is executable or not, subject to the umask like a checkout.  The
+     content of a file is fed to the fingerprint digest if one is given.'''
+  if mode == SYMLINK_MODE:
+    os.symlink(session.read(sha), path)
+    return
+  fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+               0777 if mode == EXECUTABLE_MODE else 0666)
+  with os.fdopen(fd, 'wb') as f:
+    session.stream(sha, f, fingerprint)
+
+
+_sessions = dict()
+
+
+def cat_file_session(repo):
+  'The CatFileBatch session for repo, one per thread since it is a pipe'
+  key = (repo.working_dir, threading.current_thread().ident)
+  session = _sessions.get(key)
+  if session is None:
+    session = _sessions[key] = CatFileBatch(repo.working_dir)
+  return session
+
+
+def close_sessions():
+  for session in _sessions.values():
+    session.close()
+  _sessions.clear()
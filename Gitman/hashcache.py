@@ -0,0 +1,109 @@
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+import os
+import stat
+import time
+
+
+class HashCache(object):
+  '''On-disk cache of file hashes keyed by path and lstat() signature.
+
+     An entry is only trusted while the file's inode, size, mtime and ctime
+     are unchanged.  Files modified within RACY_WINDOW seconds of being
+     hashed are only remembered for the current run and never written to
+     disk, since a later write inside the same timestamp granularity would
+     go unnoticed.'''
+
+  VERSION = 1
+  RACY_WINDOW = 2
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.__entries = dict()
+    self.__used = set()
+    self.__racy = set()
+    self.__dirty = False
+    self.load()
+
+  @staticmethod
+  def signature(stat_info):
+    return (stat_info.st_ino, stat_info.st_size,
+            stat_info.st_mtime, stat_info.st_ctime)
+
+  def load(self):
+    try:
+      with open(self.filename, 'rb') as f:
+        version, entries = pickle.load(f)
+      if version == HashCache.VERSION:
+        self.__entries = entries
+    except Exception:
+      self.__entries = dict()
+
+  def get(self, path, stat_info):
+    entry = self.__entries.get(path)
+    if entry and entry[0] == HashCache.signature(stat_info):
+      self.__used.add(path)
+      return entry[1]
+    return None
+
+  def put(self, path, stat_info, hash):
+    if not stat.S_ISREG(stat_info.st_mode):
+      return
+    if time.time() - stat_info.st_mtime < HashCache.RACY_WINDOW:
+      self.__racy.add(path)
+    else:
+      self.__racy.discard(path)
+    self.__entries[path] = (HashCache.signature(stat_info), hash)
+    self.__used.add(path)
+    self.__dirty = True
+
+  def evict(self):
+    'Drop entries whose file is gone or no longer matches its signature'
+    for path, entry in self.__entries.items():
+      if path in self.__used:
+        continue
+      try:
+        stat_info = os.lstat(path)
+      except OSError:
+        stat_info = None
+      if stat_info is None or entry[0] != HashCache.signature(stat_info):
+        del self.__entries[path]
+        self.__dirty = True
+
+  def verify(self, hasher):
+    '''Re-hash every cached file with hasher(path) and return a list of
+       (path, cached, actual) for entries that disagree.  Stale and
+       mismatching entries are evicted.'''
+    self.evict()
+    mismatches = list()
+    for path, (signature, cached) in sorted(self.__entries.items()):
+      actual = hasher(path)
+      if actual != cached:
+        mismatches.append((path, cached, actual))
+        del self.__entries[path]
+        self.__dirty = True
+    return mismatches
+
+  def save(self):
+    if not self.__dirty:
+      return
+    self.evict()
+    entries = dict((path, entry) for path, entry in self.__entries.iteritems()
+                   if path not in self.__racy)
+    tmp = self.filename + '.tmp'
+    try:
+      with open(tmp, 'wb') as f:
+        pickle.dump((HashCache.VERSION, entries), f, pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp, self.filename)
+      self.__dirty = False
+    except (IOError, OSError):
+      try:
+        os.unlink(tmp)
+      except OSError:
+        pass
+
+  def __len__(self):
+    return len(self.__entries)
@@ -0,0 +1,81 @@
+import ast
+import os
+import threading
+
+
+class DeployJournal(object):
+  '''Log of the steps a deploy has finished, so that a deploy which was
+     interrupted can be resumed rather than redone.
+
+     The file starts with the deployed and target commits it is for and is
+     ignored for any other pair.  Each step is a tuple, ('install', path),
+     ('acl', path), ('delete', path), ('crontab', user),
+     ('crontab-delete', user) or ('rpm',), written as one repr() per line
+     and flushed once the step is done.  A step lost to a crash is simply
+     done again, and a truncated line is skipped.  The file is removed once
+     the deploy completes.'''
+
+  VERSION = 1
+
+  def __init__(self, filename, base, target):
+    self.filename = filename
+    self.base = base
+    self.target = target
+    self.__done = set()
+    self.__file = None
+    self.__lock = threading.Lock()
+    self.load()
+
+  def __header(self):
+    return (DeployJournal.VERSION, self.base, self.target)
+
+  def load(self):
+    self.__done = set()
+    try:
+      with open(self.filename, 'r') as f:
+        if ast.literal_eval(f.readline()) != self.__header():
+          return
+        for line in f:
+          try:
+            self.__done.add(ast.literal_eval(line))
+          except (SyntaxError, ValueError):
+            pass
+    except (IOError, SyntaxError, ValueError):
+      pass
+
+  def __contains__(self, step):
+    return step in self.__done
+
+  def __len__(self):
+    return len(self.__done)
+
+  def begin(self):
+    'Open the journal for recording, keeping the steps of the same deploy'
+    if self.__done:
+      self.__file = open(self.filename, 'a')
+      # end a line the interrupted deploy may have left unfinished
+      self.__file.write('\n')
+    else:
+      self.__file = open(self.filename, 'w')
+      self.__file.write(repr(self.__header()) + '\n')
+      self.__file.flush()
+
+  def record(self, *step):
+    with self.__lock:
+      self.__file.write(repr(step) + '\n')
+      self.__file.flush()
+      self.__done.add(step)
+
+  def close(self):
+    if self.__file:
+      self.__file.close()
+      self.__file = None
+
+  def finish(self):
+    'The deploy completed, forget its steps'
+    self.close()
+    try:
+      os.unlink(self.filename)
+    except OSError:
+      pass
+    self.__done = set()
@@ -0,0 +1,190 @@
+import fingerprint
+import fs
+import githash
+
+import multiprocessing
+import stat
+import sys
+from multiprocessing.pool import ThreadPool
+
+
+LARGE_FILE = 16 << 20
+
+
+def _blob_hash(request):
+  'Blob id, fingerprint if one is named, and error for (path, fingerprint name)'
+  path, name = request
+  try:
+    if name is None:
+      return githash.blob_hash(path), None, None
+    return fingerprint.Fingerprint(name).hash_file(path) + (None,)
+  except (IOError, OSError) as e:
+    return None, None, e
+
+
+class _Error(object):
+  'An exception raised while gathering, re-raised when the value is used'
+  __slots__ = ('exc_info',)
+
+  def __init__(self, exc_info):
+    self.exc_info = exc_info
+
+
+class LocalState(object):
+  '''Existence, hash and ACL of deployed paths, gathered by a pool of
+     threads, with large files hashed by a pool of processes.  Errors are
+     re-raised when the failing value is asked for.  Paths the manifest
+     vouches for take their hash and ACL from it.'''
+
+  def __init__(self, hasher, acl_from_file, stats=None, threads=16,
+               processes=None, large_file=LARGE_FILE, manifest=None):
+    self.hasher = hasher
+    self.acl_from_file = acl_from_file
+    self.stats = stats or fs.StatSnapshot()
+    self.threads = threads
+    self.processes = processes
+    self.large_file = large_file
+    self.manifest = manifest
+    self.__exists = dict()
+    self.__hashes = dict()
+    self.__acls = dict()
+
+  def __call(self, func, *args):
+    try:
+      return func(*args)
+    except Exception:
+      return _Error(sys.exc_info())
+
+  def __fingerprint(self):
+    'The manifest\'s Fingerprint, if blob ids are worked out in-process'
+    if self.manifest is None or self.hasher.use_git:
+      return None
+    return self.manifest.fingerprint
+
+  def __hash(self, path, stat_info):
+    '''(hash, fingerprint) of a file not in the hash cache, the fingerprint
+       being None unless the manifest wants one'''
+    fingerprint = self.__fingerprint()
+    if fingerprint is None or not stat.S_ISREG(stat_info.st_mode):
+      return self.hasher.hash(path, True, stat_info), None
+    hash, value = fingerprint.hash_file(path)
+    self.hasher.store(path, stat_info, hash)
+    return hash, value
+
+  def __record(self, path, stat_info, hash, acl, states, fingerprint=None):
+    'Update the manifest after a full check of path'
+    if isinstance(hash, _Error) or isinstance(acl, _Error):
+      return
+    for state_hash, state_acl in states:
+      if hash == state_hash and acl == state_acl:
+        self.manifest.record(path, stat_info, hash, acl, fingerprint)
+        return
+    self.manifest.confirm(path, stat_info, hash, acl, fingerprint)
+
+  def __inspect(self, request):
+    path, want_hash, want_acl = request[:3]
+    states = request[3] if len(request) > 3 else ()
+    stat_info = self.stats.lstat(path)
+    if stat_info is None:
+      return path, False, None, None, None
+    if self.manifest is not None:
+      recorded = self.manifest.get(path, stat_info)
+      if recorded is not None:
+        hash, acl = recorded
+        return (path, True, hash if want_hash else None,
+                acl if want_acl else None, None)
+    acl = self.__call(self.acl_from_file, path, stat_info) if want_acl else None
+    hash = fingerprint = None
+    if want_hash:
+      hash = self.hasher.lookup(path, stat_info)
+      if hash is None and self.manifest is not None:
+        hash, fingerprint = self.manifest.verify(path, stat_info,
+                                                 not self.hasher.use_git)
+        if hash is not None:
+          self.hasher.store(path, stat_info, hash)
+      if hash is None:
+        if (stat.S_ISREG(stat_info.st_mode) and not self.hasher.use_git and
+            stat_info.st_size >= self.large_file):
+          return path, True, None, acl, (stat_info, states)
+        result = self.__call(self.__hash, path, stat_info)
+        if isinstance(result, _Error):
+          hash = result
+        else:
+          hash, fingerprint = result
+    if self.manifest is not None and want_acl:
+      self.__record(path, stat_info, hash, acl, states, fingerprint)
+    return path, True, hash, acl, None
+
+  def gather(self, requests):
+    '''Inspect (path, want_hash, want_acl[, states]) requests.  Hashes are
+       only taken of paths that exist.  states lists the (hash, ACL) pairs
+       under which a path may be recorded in the manifest, hash being None
+       for a directory.'''
+    requests = [request for request in requests
+                if request[0] not in self.__exists]
+    if not requests:
+      return
+    pool = ThreadPool(min(self.threads, len(requests)))
+    try:
+      results = pool.map(self.__inspect, requests)
+    finally:
+      pool.close()
+      pool.join()
+
+    large = []
+    for path, path_exists, hash, acl, pending in results:
+      self.__exists[path] = path_exists
+      if hash is not None:
+        self.__hashes[path] = hash
+      if acl is not None:
+        self.__acls[path] = acl
+      if pending is not None:
+        large.append((path, pending[0], acl, pending[1]))
+    if large:
+      self.__hash_large(large)
+
+  def __hash_large(self, large):
+    fingerprint = self.__fingerprint()
+    name = fingerprint.name if fingerprint is not None else None
+    requests = [(path, name) for path, stat_info, acl, states in large]
+    if len(large) == 1:
+      hashes = [_blob_hash(requests[0])]
+    else:
+      pool = multiprocessing.Pool(min(self.processes or multiprocessing.cpu_count(),
+                                      len(large)))
+      try:
+        hashes = pool.map(_blob_hash, requests, chunksize=1)
+      finally:
+        pool.close()
+        pool.join()
+    for (path, stat_info, acl, states), (hash, value, error) in zip(large, hashes):
+      if error is not None:
+        # the path is hashed again, and the error raised, when it is used
+        continue
+      self.hasher.store(path, stat_info, hash)
+      self.__hashes[path] = hash
+      if self.manifest is not None and acl is not None:
+        self.__record(path, stat_info, hash, acl, states, value)
+
+  def __value(self, values, path):
+    value = values[path]
+    if isinstance(value, _Error):
+      exc_type, exc_value, exc_tb = value.exc_info
+      raise exc_type, exc_value, exc_tb
+    return value
+
+  def exists(self, path):
+    'Like os.path.lexists()'
+    if path not in self.__exists:
+      self.__exists[path] = self.stats.lexists(path)
+    return self.__exists[path]
+
+  def hash(self, path):
+    if path not in self.__hashes:
+      return self.hasher.hash(path, True, self.stats.lstat(path))
+    return self.__value(self.__hashes, path)
+
+  def acl(self, path):
+    if path not in self.__acls:
+      return self.acl_from_file(path, self.stats.lstat(path))
+    return self.__value(self.__acls, path)
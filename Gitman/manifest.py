@@ -0,0 +1,131 @@
+try:
+  import cPickle as pickle
+except ImportError:
+  import pickle
+
+import hashcache
+
+import os
+import stat
+import time
+
+
+class Manifest(object):
+  '''Hash, ACL, lstat() signature and fingerprint of every deployed path as
+     gitman last wrote or checked it, so unchanged paths are compared with
+     one lstat().  Racy entries are not trusted, as in hashcache.HashCache.'''
+
+  VERSION = 3
+  RACY_WINDOW = hashcache.HashCache.RACY_WINDOW
+
+  def __init__(self, filename, fingerprint=None):
+    self.filename = filename
+    self.fingerprint = fingerprint
+    self.__entries = dict()
+    self.__dirty = False
+    self.load()
+
+  @staticmethod
+  def signature(stat_info):
+    return (stat_info.st_ino, stat_info.st_size, stat_info.st_mode,
+            stat_info.st_uid, stat_info.st_gid,
+            stat_info.st_mtime, stat_info.st_ctime)
+
+  def load(self):
+    try:
+      with open(self.filename, 'rb') as f:
+        version, entries = pickle.load(f)
+      if version == Manifest.VERSION:
+        self.__entries = entries
+    except Exception:
+      self.__entries = dict()
+
+  def get(self, path, stat_info):
+    '(hash, acl) recorded for path if its lstat() still matches, else None'
+    entry = self.__entries.get(path)
+    if (entry is None or entry[3] or
+        entry[0] != Manifest.signature(stat_info)):
+      return None
+    return entry[1], entry[2]
+
+  def put(self, path, stat_info, hash, acl, fingerprint=None):
+    '''Record path.  fingerprint is kept for regular files only, and is
+       taken by whoever read the content, as nothing is read here.'''
+    if not stat.S_ISREG(stat_info.st_mode):
+      fingerprint = None
+    racy = time.time() - stat_info.st_mtime < Manifest.RACY_WINDOW
+    self.__entries[path] = (Manifest.signature(stat_info), hash, acl, racy,
+                            fingerprint)
+    self.__dirty = True
+
+  def verify(self, path, stat_info, blob=True):
+    '''(hash, fingerprint) of a file known to the manifest from a single
+       read: the recorded hash if the content still has the recorded
+       fingerprint, else its blob id if blob is set, else None.  (None, None)
+       if there is no fingerprint to check against.  Without blob only the
+       fingerprint is taken, which spares running git on unchanged files.'''
+    entry = self.__entries.get(path)
+    if (entry is None or not stat.S_ISREG(stat_info.st_mode) or
+        self.fingerprint is None or not self.fingerprint.owns(entry[4])):
+      return None, None
+    try:
+      fingerprint, hash = self.fingerprint.check(path, blob)
+    except (IOError, OSError):
+      return None, None
+    if fingerprint == entry[4]:
+      return entry[1], fingerprint
+    return hash, fingerprint
+
+  def record(self, path, stat_info, hash, acl, fingerprint=None):
+    '''Record the hash and ACL a full check found path to have, keeping the
+       fingerprint while the content is the one recorded unless a fresh one
+       is given'''
+    entry = self.__entries.get(path)
+    if entry is None or entry[1] != hash:
+      self.put(path, stat_info, hash, acl, fingerprint)
+      return
+    if (not entry[3] and entry[0] == Manifest.signature(stat_info) and
+        (entry[2] is acl or entry[2] == acl) and
+        (fingerprint is None or fingerprint == entry[4])):
+      return
+    if (fingerprint is None and self.fingerprint is not None and
+        self.fingerprint.owns(entry[4])):
+      fingerprint = entry[4]
+    self.put(path, stat_info, hash, acl, fingerprint)
+
+  def confirm(self, path, stat_info, hash, acl, fingerprint=None):
+    '''Record the new lstat() of path if a fresh hash and ACL agree with its
+       entry, which is trusted from then on unless it is racy again'''
+    entry = self.__entries.get(path)
+    if (entry is not None and entry[1] == hash and
+        (entry[2] is acl or entry[2] == acl)):
+      self.record(path, stat_info, hash, acl, fingerprint)
+
+  def discard(self, path):
+    if self.__entries.pop(path, None) is not None:
+      self.__dirty = True
+
+  def retain(self, paths):
+    'Forget every path not in paths'
+    for path in [path for path in self.__entries if path not in paths]:
+      del self.__entries[path]
+      self.__dirty = True
+
+  def save(self):
+    if not self.__dirty:
+      return
+    tmp = self.filename + '.tmp'
+    try:
+      with open(tmp, 'wb') as f:
+        pickle.dump((Manifest.VERSION, self.__entries), f,
+                    pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp, self.filename)
+      self.__dirty = False
+    except (IOError, OSError, pickle.PicklingError):
+      try:
+        os.unlink(tmp)
+      except OSError:
+        pass
+
+  def __len__(self):
+    return len(self.__entries)
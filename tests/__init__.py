@@ -1,2 +1,4 @@
 import acl_ut
-
+import antglob_ut
+import plan_ut
+import resume_ut
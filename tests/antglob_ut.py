@@ -0,0 +1,147 @@
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Gitman.antglob import ant_rules
+from Gitman.gittools import PathTree
+
+
+NAMES = ['a', 'b', 'a.c', 'b.txt', 'x+y', '.git', '.gitignore']
+SEGMENTS = ['**', '**', '*', 'a', 'b', '*.c', 'a*', '?', '*.txt', 'x+y', '.git']
+
+
+def baseline_glob(start_dir, incl, excl=('.git', '.gitignore'), maxdepth=25):
+  '''ant_glob(start_dir=..., incl=..., dir=True) as gitman had it before the
+     walker was rewritten, kept as the reference the new one is held to'''
+
+  def to_pat(lst):
+    ret = []
+    for x in lst:
+      x = x.replace('\\', '/').replace('//', '/')
+      if x.endswith('/'):
+        x += '**'
+      accu = []
+      for k in x.split('/'):
+        if k == '**':
+          accu.append(k)
+        else:
+          k = k.replace('.', '[.]').replace('*','.*').replace('?', '.').replace('+', '\\+')
+          accu.append(re.compile('^%s$' % k))
+      ret.append(accu)
+    return ret
+
+  def filtre(name, nn):
+    ret = []
+    for lst in nn:
+      if not lst:
+        pass
+      elif lst[0] == '**':
+        ret.append(lst)
+        if len(lst) > 1:
+          if lst[1].match(name):
+            ret.append(lst[2:])
+        else:
+          ret.append([])
+      elif lst[0].match(name):
+        ret.append(lst[1:])
+    return ret
+
+  def accept(name, pats):
+    nacc = filtre(name, pats[0])
+    nrej = filtre(name, pats[1])
+    if [] in nrej:
+      nacc = []
+    return [nacc, nrej]
+
+  def ant_iter(current_dir, pats, maxdepth):
+    for name in sorted(os.listdir(current_dir)):
+      npats = accept(name, pats)
+      if npats and npats[0]:
+        abspath = os.path.join(current_dir, name)
+        if [] in npats[0]:
+          yield abspath
+        if os.path.isdir(abspath) and maxdepth:
+          for k in ant_iter(abspath, npats, maxdepth - 1):
+            yield k
+
+  return list(ant_iter(start_dir, [to_pat(incl), to_pat(excl)], maxdepth))
+
+
+class AntRulesTestCase(unittest.TestCase):
+  '''ant_rules() has to give what globbing each include and exclude on its
+     own with the original ant_glob gave'''
+
+  CASES = 500
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def tree(self, rand, root):
+    'Create random files below root and return their paths'
+    files = set()
+    for n in xrange(rand.randint(1, 12)):
+      path = os.path.join(root, *[rand.choice(NAMES)
+                                  for d in xrange(rand.randint(1, 4))])
+      if any(path.startswith(file + '/') or file.startswith(path + '/')
+             for file in files):
+        continue
+      files.add(path)
+    for path in files:
+      if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+      open(path, 'w').close()
+    return files
+
+  def patterns(self, rand, count):
+    patterns = []
+    for n in xrange(count):
+      segments = []
+      for d in xrange(rand.randint(1, 4)):
+        segment = rand.choice(SEGMENTS)
+        # the original ant_glob failed on **/**
+        if not (segment == '**' and segments[-1:] == ['**']):
+          segments.append(segment)
+      pattern = '/'.join(segments)
+      if segments[-1] != '**' and rand.random() < 0.1:
+        pattern += '/'
+      patterns.append(pattern)
+    return patterns
+
+  def testAgainstBaseline(self):
+    for seed in xrange(self.CASES):
+      rand = random.Random(seed)
+      root = os.path.join(self.tmp, str(seed))
+      tree = PathTree(self.tree(rand, root))
+      includes = self.patterns(rand, rand.randint(1, 4))
+      excludes = self.patterns(rand, rand.randint(0, 3))
+
+      excluded = set()
+      for pattern in excludes:
+        excluded.update(baseline_glob(root, [pattern]))
+      expected = dict()
+      for n, pattern in enumerate(includes):
+        for path in baseline_glob(root, [pattern]):
+          if path not in excluded:
+            expected[path] = (os.path.isdir(path), n)
+
+      dropped = []
+      found = dict((path, (isdir, n)) for path, isdir, n in
+                   ant_rules(root, includes, excludes, tree, dropped=dropped))
+      case = 'seed %d, include %r, exclude %r' % (seed, includes, excludes)
+      self.assertEqual(found, expected, case)
+      self.assertEqual(set(dropped), excluded, case)
+      self.assertEqual(found, dict((path, (isdir, n)) for path, isdir, n in
+                                   ant_rules(root, includes, excludes, tree)), case)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,177 @@
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+os.environ['GITMAN_NOACL'] = '1'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import Gitman.Gitman as gitman
+from Gitman.acl import ACL, has_xacl, ids as acl_ids
+
+# main() normally imports these into the module
+gitman.ACL = ACL
+gitman.has_xacl = has_xacl
+gitman.acl_ids = acl_ids
+
+
+HOST = 'testhost'
+NAMES = ['a', 'b', 'c']
+
+SINGLE_ROOT = [
+  'include srv/gmtest/** mode=0644',
+  'exclude srv/gmtest/**/c',
+]
+# a host root overlaid on a common one, so both can hold the same path
+OVERLAY = [
+  'root machines/common',
+  'include srv/gmtest/** mode=0644',
+  'root machines/%s' % HOST,
+  'include srv/gmtest/** mode=0640',
+  'exclude srv/gmtest/**/c',
+]
+
+
+def git(cwd, *args):
+  return subprocess.check_output(('git',) + args, cwd=cwd).rstrip('\n')
+
+
+class History(object):
+  'A random history of a host root, pushed to a bare origin'
+
+  def __init__(self, tmp, seed, host_file=SINGLE_ROOT, depth=4):
+    self.random = random.Random(seed)
+    self.roots = [line.split(' ', 1)[1] for line in host_file
+                  if line.startswith('root ')] or [os.path.join('machines', HOST)]
+    self.depth = depth
+    self.work = os.path.join(tmp, 'work')
+    self.origin = os.path.join(tmp, 'origin.git')
+    self.clone = os.path.join(tmp, 'clone')
+    self.files = set()
+    self.commits = []
+
+    os.makedirs(os.path.join(self.work, 'hosts'))
+    git(self.work, 'init', '-q')
+    git(self.work, 'config', 'user.email', 'plan@test')
+    git(self.work, 'config', 'user.name', 'plan test')
+    with open(os.path.join(self.work, 'config'), 'w') as f:
+      f.write('host_dir: hosts\n')
+    with open(os.path.join(self.work, 'hosts', HOST), 'w') as f:
+      f.write(''.join(line + '\n' for line in host_file))
+    for n in xrange(3):
+      self.add()
+    self.commit()
+
+  def path(self):
+    depth = self.random.randint(1, self.depth)
+    return (self.random.choice(self.roots),
+            os.path.join(*[self.random.choice(NAMES) for n in xrange(depth)]))
+
+  def conflicts(self, (root, path)):
+    '''A file may shadow the same path in another root, but no root may
+       have a file where another has a directory'''
+    parts = path.split('/')
+    prefixes = set('/'.join(parts[:n]) for n in xrange(1, len(parts)))
+    return any(file in prefixes or file.startswith(path + '/')
+               for file_root, file in self.files) or (root, path) in self.files
+
+  def full(self, (root, path)):
+    return os.path.join(self.work, root, 'srv', 'gmtest', path)
+
+  def write(self, path):
+    full = self.full(path)
+    if not os.path.isdir(os.path.dirname(full)):
+      os.makedirs(os.path.dirname(full))
+    with open(full, 'w') as f:
+      f.write('%s %f\n' % (full, self.random.random()))
+
+  def add(self):
+    for attempt in xrange(20):
+      path = self.path()
+      if not self.conflicts(path):
+        self.write(path)
+        self.files.add(path)
+        return
+
+  def modify(self):
+    if self.files:
+      self.write(self.random.choice(sorted(self.files)))
+
+  def delete(self):
+    if len(self.files) > 1:
+      path = self.random.choice(sorted(self.files))
+      full = self.full(path)
+      os.unlink(full)
+      try:
+        os.removedirs(os.path.dirname(full))
+      except OSError:
+        pass
+      self.files.remove(path)
+
+  def commit(self):
+    git(self.work, 'add', '-A')
+    git(self.work, 'commit', '-q', '--allow-empty', '-m', str(len(self.commits)))
+    self.commits.append(git(self.work, 'rev-parse', 'HEAD'))
+
+  def step(self):
+    for n in xrange(self.random.randint(1, 3)):
+      self.random.choice([self.add, self.add, self.modify, self.delete])()
+    self.commit()
+
+  def publish(self):
+    git(self.work, 'init', '-q', '--bare', self.origin)
+    git(self.work, 'push', '-q', self.origin, 'HEAD:refs/heads/master')
+    git(os.path.dirname(self.clone), 'clone', '-q', self.origin, self.clone)
+
+
+class PlanFromDiffTestCase(unittest.TestCase):
+  '''The deployed file map planned from diff-tree has to be the one
+     loading the deployed revision in full gives'''
+
+  HISTORIES = 15
+  COMMITS = 6
+  HOST_FILE = SINGLE_ROOT
+  DEPTH = 4
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def plan(self, clone, deployed, plan_from_diff):
+    with open(os.path.join(clone, '.git', 'gitman_deploy.master'), 'w') as f:
+      f.write(deployed)
+    gm = gitman.GitMan(clone, assume_host=HOST, plan_from_diff=plan_from_diff)
+    try:
+      return dict((file, (args['isdir'], args.get('hash'), args['acl']))
+                  for file, args in gm.original_files.iteritems())
+    finally:
+      gm.close()
+
+  def testPlanFromDiff(self):
+    for seed in xrange(self.HISTORIES):
+      tmp = os.path.join(self.tmp, str(seed))
+      os.makedirs(tmp)
+      history = History(tmp, seed, self.HOST_FILE, self.DEPTH)
+      for n in xrange(self.COMMITS):
+        history.step()
+      history.publish()
+      for deployed in history.commits[:-1]:
+        self.assertEqual(self.plan(history.clone, deployed, True),
+                         self.plan(history.clone, deployed, False),
+                         'seed %d, deployed %s' % (seed, deployed))
+
+
+class OverlayPlanFromDiffTestCase(PlanFromDiffTestCase):
+  'The same with two roots, shallow so that they often share paths'
+
+  HOST_FILE = OVERLAY
+  DEPTH = 2
+
+
+if __name__ == '__main__':
+  unittest.main()
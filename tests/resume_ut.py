@@ -0,0 +1,139 @@
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+
+os.environ['GITMAN_NOACL'] = '1'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import Gitman.Gitman as gitman
+from Gitman.acl import ACL, has_xacl, ids as acl_ids
+
+# main() normally imports these into the module
+gitman.ACL = ACL
+gitman.has_xacl = has_xacl
+gitman.acl_ids = acl_ids
+
+
+HOST = 'testhost'
+FIRST = {'a': 'a\n', 'b/c': 'c\n', 'b/d': 'd\n', 'e/f': 'f\n'}
+SECOND = {'a': 'a2\n', 'b/c': 'c\n', 'b/g': 'g\n', 'e/f': 'f2\n',
+          'h/i': 'i\n', 'h/j/k': 'k\n', 'l': 'l\n'}
+
+
+def git(cwd, *args):
+  return subprocess.check_output(('git',) + args, cwd=cwd).rstrip('\n')
+
+
+class Interrupted(Exception):
+  pass
+
+
+class ResumeTestCase(unittest.TestCase):
+  '''A deploy cut short is resumed by the next one without holdups for what
+     it already wrote'''
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.target = os.path.join(self.tmp, 'target')
+    self.work = os.path.join(self.tmp, 'work')
+    self.origin = os.path.join(self.tmp, 'origin.git')
+    self.clone = os.path.join(self.tmp, 'clone')
+    os.makedirs(os.path.join(self.work, 'hosts'))
+    git(self.work, 'init', '-q')
+    git(self.work, 'config', 'user.email', 'resume@test')
+    git(self.work, 'config', 'user.name', 'resume test')
+    with open(os.path.join(self.work, 'config'), 'w') as f:
+      f.write('host_dir: hosts\n')
+    with open(os.path.join(self.work, 'hosts', HOST), 'w') as f:
+      # not the mode files are copied with, so a missing ACL step shows
+      f.write('include %s/** mode=0600\n' % self.target.lstrip('/'))
+    self.commit(FIRST)
+    git(self.work, 'init', '-q', '--bare', self.origin)
+    git(self.work, 'push', '-q', self.origin, 'HEAD:refs/heads/master')
+    git(self.tmp, 'clone', '-q', self.origin, self.clone)
+    self.deploy()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def commit(self, files):
+    root = os.path.join(self.work, 'machines', HOST, self.target.lstrip('/'))
+    if os.path.isdir(root):
+      shutil.rmtree(root)
+    for path, content in files.iteritems():
+      full = os.path.join(root, path)
+      if not os.path.isdir(os.path.dirname(full)):
+        os.makedirs(os.path.dirname(full))
+      with open(full, 'w') as f:
+        f.write(content)
+    git(self.work, 'add', '-A')
+    git(self.work, 'commit', '-q', '-m', str(len(files)))
+
+  def publish(self, files):
+    self.commit(files)
+    git(self.work, 'push', '-q', self.origin, 'HEAD:refs/heads/master')
+
+  def deploy(self, interrupt=None):
+    '''Inspect and deploy, with interrupt(gm) set up to cut the deploy short.
+       Returns the holdups and whether an interrupted deploy was resumed.'''
+    gm = gitman.GitMan(self.clone, assume_host=HOST)
+    try:
+      holdups, verbose_info, failures = gm.show_deployment(False, False)
+      self.assertEqual(failures, [])
+      if interrupt:
+        interrupt(gm)
+      gm.deploy(force=False, backup=False)
+      return holdups, any(line.startswith('RESUMING') for line in verbose_info)
+    finally:
+      gm.close()
+
+  def assertDeployed(self, files):
+    found = dict()
+    for dir, dirs, names in os.walk(self.target):
+      for name in names:
+        full = os.path.join(dir, name)
+        self.assertEqual(stat.S_IMODE(os.lstat(full).st_mode), 0600, full)
+        with open(full) as f:
+          found[os.path.relpath(full, self.target)] = f.read()
+    self.assertEqual(found, files)
+
+  def resume(self, interrupt):
+    self.publish(SECOND)
+    self.assertRaises(Interrupted, self.deploy, interrupt)
+    journal = os.path.join(self.clone, '.git', 'gitman_journal.master')
+    self.assertTrue(os.path.exists(journal))
+    self.assertEqual(self.deploy(), ([], True))
+    self.assertFalse(os.path.exists(journal))
+    self.assertDeployed(SECOND)
+    self.assertEqual(self.deploy(), ([], False))
+
+  def testBetweenFiles(self):
+    def interrupt(gm):
+      install_file = gm.install_file
+      installed = []
+      def interrupted(*args, **kw):
+        if len(installed) == 3:
+          raise Interrupted()
+        installed.append(args[0])
+        return install_file(*args, **kw)
+      gm.install_file = interrupted
+    self.resume(interrupt)
+
+  def testWithinFile(self):
+    'Cut short after the content of a file is written but before its ACL'
+    def interrupt(gm):
+      record = gm.journal.record
+      def interrupted(*step):
+        record(*step)
+        if step[0] == 'install' and not os.path.isdir(step[1]):
+          raise Interrupted()
+      gm.journal.record = interrupted
+    self.resume(interrupt)
+
+
+if __name__ == '__main__':
+  unittest.main()